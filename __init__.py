@@ -1,24 +1,122 @@
 from __future__ import annotations
 
+import voluptuous as vol
+
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
-from homeassistant.const import CONF_MAC
+from homeassistant.core import HomeAssistant, ServiceCall, ServiceResponse, SupportsResponse
+from homeassistant.const import ATTR_ENTITY_ID, CONF_MAC
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers import entity_registry
+import homeassistant.helpers.config_validation as cv
+
+from .const import DOMAIN, LOGGER, DATA_DETACH_BLUETOOTH, DATA_STREAM
+from .tl100.const import EFFECTS, GROUP_CONCURRENCY, STREAM_HOST, STREAM_PORT
+from .tl100.beurer import BeurerInstance
+from .tl100.scanner import ADVERTISEMENTS
+from .tl100.emulator import install_from_env
+from .tl100 import recorder
+from .tl100.group import set_group, spread
+from .tl100.streaming import ColorStream
+from .tl100.probe import PROBES
+
+PLATFORMS = ["light", "sensor"]
+
+SERVICE_SET_GROUP = "set_group"
+SET_GROUP_SCHEMA = vol.Schema({
+    vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
+    vol.Optional("on", default=True): cv.boolean,
+    vol.Optional("rgb_color"): vol.All(vol.ExactSequence((cv.byte, cv.byte, cv.byte)), vol.Coerce(tuple)),
+    vol.Optional("color_brightness"): vol.All(vol.Coerce(int), vol.Range(min=1, max=255)),
+    vol.Optional("white_brightness"): vol.All(vol.Coerce(int), vol.Range(min=1, max=255)),
+    vol.Optional("effect"): vol.In(EFFECTS),
+    vol.Optional("concurrency", default=GROUP_CONCURRENCY): vol.All(vol.Coerce(int), vol.Range(min=1, max=50)),
+})
+
+SERVICE_START_STREAM = "start_stream"
+START_STREAM_SCHEMA = vol.Schema({
+    vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
+    vol.Optional("host", default=STREAM_HOST): cv.string,
+    vol.Optional("port", default=STREAM_PORT): cv.port,
+})
+SERVICE_STOP_STREAM = "stop_stream"
 
-from bleak import BleakScanner, BLEDevice
+async def async_attach_bluetooth(hass: HomeAssistant):
+    """Prefer Home Assistant's bluetooth integration over an own scanner, also from the config flow."""
+    if "bluetooth" in hass.config.components and DATA_DETACH_BLUETOOTH not in hass.data:
+        hass.data[DATA_DETACH_BLUETOOTH] = await ADVERTISEMENTS.async_attach_hass(hass)
 
-from .const import DOMAIN, LOGGER
-from .beurer import BeurerInstance, get_device
+def _instances(hass: HomeAssistant, entity_ids: list[str]) -> dict:
+    registry = entity_registry.async_get(hass)
+    instances = {}
+    for entity_id in entity_ids:
+        entry = registry.async_get(entity_id)
+        instance = hass.data.get(DOMAIN, {}).get(entry.config_entry_id) if entry else None
+        if instance is None:
+            raise HomeAssistantError(f"{entity_id} is not a Beurer light")
+        instances[entity_id] = instance
+    return instances
 
-PLATFORMS = ["light"]
+async def async_start_stream(hass: HomeAssistant, call: ServiceCall) -> ServiceResponse:
+    """Forward RGB frames received on a UDP port to the lamps, lamp index is the position in entity_id."""
+    if hass.data.get(DATA_STREAM):
+        raise HomeAssistantError("A stream is already running, stop it first")
+    instances = _instances(hass, call.data[ATTR_ENTITY_ID])
+    stream = ColorStream(list(instances.values()), host=call.data["host"], port=call.data["port"])
+    await stream.start()
+    hass.data[DATA_STREAM] = stream
+    return {"host": stream.host, "port": stream.port, "lamps": {entity_id: index for index, entity_id in enumerate(instances)}}
+
+async def async_stop_stream(hass: HomeAssistant, call: ServiceCall) -> ServiceResponse:
+    """Stop the stream and report achieved frame rate and latency per lamp."""
+    stream = hass.data.pop(DATA_STREAM, None)
+    if stream is None:
+        raise HomeAssistantError("No stream is running")
+    return await stream.stop()
+
+async def async_set_group(hass: HomeAssistant, call: ServiceCall) -> ServiceResponse:
+    """Send the same state to many lamps at once and report per lamp results."""
+    instances = _instances(hass, call.data[ATTR_ENTITY_ID])
+    results = await set_group(
+        list(instances.values()), call.data["concurrency"], call.data["on"],
+        white_brightness=call.data.get("white_brightness"), rgb_color=call.data.get("rgb_color"),
+        color_brightness=call.data.get("color_brightness"), effect=call.data.get("effect"))
+    window = spread(results)
+    return {
+        "lamps": {entity_id: result.as_dict() for entity_id, result in zip(instances, results)},
+        "spread_ms": round(window * 1000, 1) if window is not None else None,
+    }
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up Beurer from a config entry."""
     LOGGER.debug(f"Setting up device from __init__")
-    device = await get_device(entry.data[CONF_MAC])
-    if device == None:
-        LOGGER.error(f"Was not able to find device with mac {entry.data[CONF_MAC]}")
-    instance = BeurerInstance(device)
+    install_from_env(ADVERTISEMENTS)
+    recorder.install_from_env()
+    await async_attach_bluetooth(hass)
+    #Setup does not wait for a scan, lamps not advertised yet are looked for in the background.
+    #All entries share one scanner so they resolve concurrently.
+    advertisement = ADVERTISEMENTS.get(entry.data[CONF_MAC])
+    instance = BeurerInstance(advertisement.device if advertisement else entry.data[CONF_MAC])
+    if not instance.is_ready:
+        LOGGER.info(f"Device {entry.data[CONF_MAC]} not seen yet, looking for it in the background")
+        instance.start_resolving()
     hass.data.setdefault(DOMAIN, {})[entry.entry_id] = instance
+    #Catches silent disconnects and changes made with the lamp's buttons
+    PROBES.register(instance)
+    if not hass.services.has_service(DOMAIN, SERVICE_SET_GROUP):
+        async def handle_set_group(call: ServiceCall) -> ServiceResponse:
+            return await async_set_group(hass, call)
+        hass.services.async_register(DOMAIN, SERVICE_SET_GROUP, handle_set_group, SET_GROUP_SCHEMA,
+                                     supports_response=SupportsResponse.OPTIONAL)
+
+        async def handle_start_stream(call: ServiceCall) -> ServiceResponse:
+            return await async_start_stream(hass, call)
+        hass.services.async_register(DOMAIN, SERVICE_START_STREAM, handle_start_stream, START_STREAM_SCHEMA,
+                                     supports_response=SupportsResponse.OPTIONAL)
+
+        async def handle_stop_stream(call: ServiceCall) -> ServiceResponse:
+            return await async_stop_stream(hass, call)
+        hass.services.async_register(DOMAIN, SERVICE_STOP_STREAM, handle_stop_stream,
+                                     supports_response=SupportsResponse.OPTIONAL)
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
     return True
 
@@ -27,5 +125,18 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     if unload_ok:
         instance = hass.data[DOMAIN].pop(entry.entry_id)
-        await instance.disconnect()
+        PROBES.unregister(instance)
+        await instance.close()
+        if not hass.data[DOMAIN]:
+            stream = hass.data.pop(DATA_STREAM, None)
+            if stream:
+                await stream.stop()
+            await recorder.async_stop_installed()
+            detach = hass.data.pop(DATA_DETACH_BLUETOOTH, None)
+            if detach:
+                detach()
+            await ADVERTISEMENTS.async_stop()
+            hass.services.async_remove(DOMAIN, SERVICE_SET_GROUP)
+            hass.services.async_remove(DOMAIN, SERVICE_START_STREAM)
+            hass.services.async_remove(DOMAIN, SERVICE_STOP_STREAM)
     return unload_ok
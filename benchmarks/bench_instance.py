@@ -0,0 +1,247 @@
+"""End-to-end benchmarks of BeurerInstance against emulated lamps.
+
+Run from the repository root: python benchmarks/bench_instance.py [--json] [options]
+Needs bleak installed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tl100 import beurer, connection, emulator, streaming, scanner
+
+LAMP_SETTINGS = {}
+INSTANCE_SETTINGS = {}
+
+def emulated_lamp(index: int, adapters: int):
+    address = f"EE:00:00:00:00:{index:02X}"
+    lamp = emulator.EMULATOR.lamp(address) or emulator.EMULATOR.add_lamp(address, adapter=f"emulator{index % adapters}")
+    for name, value in LAMP_SETTINGS.items():
+        setattr(lamp, name, value)
+    return lamp
+
+async def connected_instance(index: int = 0, adapters: int = 1):
+    lamp = emulated_lamp(index, adapters)
+    instance = beurer.BeurerInstance(lamp.device, client_class=emulator.EmulatedBleakClient, **INSTANCE_SETTINGS)
+    await instance.connect()
+    return instance
+
+async def measure(instance, operation) -> dict:
+    #Frames of the setup step still in flight must not count for the operation
+    await instance._window.drain()
+    writes = len(instance._device.writes)
+    start = time.perf_counter()
+    await operation(instance)
+    #Pipelined frames may still be on their way
+    await instance._window.drain()
+    return {"latency_ms": round((time.perf_counter() - start) * 1000, 2), "packets": len(instance._device.writes) - writes}
+
+async def prepare_color_off(instance):
+    await instance.turn_off()
+    instance._mode = beurer.COLOR_MODE_RGB
+
+OPERATIONS = {
+    "turn_on_restore": (prepare_color_off, lambda instance: instance.turn_on()),
+    "turn_on": (None, lambda instance: instance.turn_on()),
+    "set_color": (None, lambda instance: instance.set_color((255, 0, 0))),
+    "set_white": (None, lambda instance: instance.set_white(128)),
+    "set_effect": (None, lambda instance: instance.set_effect("Rainbow")),
+    "apply_state": (prepare_color_off, lambda instance: instance.apply_state(rgb_color=(0, 255, 0), effect="Off", color_brightness=200)),
+    "turn_off": (None, lambda instance: instance.turn_off()),
+    "update": (None, lambda instance: instance.update()),
+}
+
+async def bench_operations(repeat: int) -> dict:
+    results = {}
+    for name, (prepare, operation) in OPERATIONS.items():
+        samples = []
+        for _ in range(repeat):
+            instance = await connected_instance()
+            await instance.turn_on()
+            if prepare:
+                await prepare(instance)
+            samples.append(await measure(instance, operation))
+            await instance.disconnect()
+        latencies = [sample["latency_ms"] for sample in samples]
+        results[name] = {
+            "median_ms": round(statistics.median(latencies), 2),
+            "max_ms": max(latencies),
+            "packets": samples[-1]["packets"],
+        }
+    return results
+
+async def bench_slider_burst(calls: int, interval: float) -> dict:
+    """set_color calls arriving like a dragged color slider."""
+    instance = await connected_instance()
+    await instance.turn_on()
+    writes = len(instance._device.writes)
+    start = time.perf_counter()
+    tasks = []
+    for step in range(calls):
+        tasks.append(asyncio.create_task(instance.set_color((step % 256, 128, 255 - step % 256))))
+        await asyncio.sleep(interval)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    await instance.disconnect()
+    return {
+        "calls": calls,
+        "duration_ms": round(elapsed * 1000, 2),
+        "calls_per_sec": round(calls / elapsed, 1),
+        "packets": len(instance._device.writes) - writes,
+        "queue": instance.command_stats,
+    }
+
+async def bench_concurrent(instances: int, adapters: int) -> dict:
+    """The same transaction on many lamps at once."""
+    lamps = await asyncio.gather(*[connected_instance(index, adapters) for index in range(instances)])
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*[measure(lamp, lambda instance: instance.apply_state(rgb_color=(10, 20, 30))) for lamp in lamps])
+    elapsed = time.perf_counter() - start
+    for lamp in lamps:
+        await lamp.disconnect()
+    return {
+        "instances": instances,
+        "wall_ms": round(elapsed * 1000, 2),
+        "median_ms": round(statistics.median(sample["latency_ms"] for sample in latencies), 2),
+        "packets": sum(sample["packets"] for sample in latencies),
+        "adapters": connection.CONNECTIONS.stats(),
+    }
+
+async def bench_streaming(packets: int) -> dict:
+    """Distinct color frames written back to back, pipelined and acknowledged."""
+    results = {}
+    for mode, pipelined in (("pipelined", True), ("acknowledged", False)):
+        lamp = emulated_lamp(0, 1)
+        settings = dict(INSTANCE_SETTINGS, pipelined=pipelined)
+        instance = beurer.BeurerInstance(lamp.device, client_class=emulator.EmulatedBleakClient, **settings)
+        await instance.connect()
+        writes = len(instance._device.writes)
+        start = time.perf_counter()
+        for step in range(packets):
+            await instance.sendPacket([0x32, step % 256, 128, 255 - step % 256])
+        await instance._window.drain()
+        elapsed = time.perf_counter() - start
+        results[mode] = {
+            "packets": len(instance._device.writes) - writes,
+            "duration_ms": round(elapsed * 1000, 2),
+            "packets_per_sec": round(packets / elapsed, 1),
+            "write_window": instance._window.stats(),
+        }
+        await instance.disconnect()
+    results["speedup"] = round(results["pipelined"]["packets_per_sec"] / results["acknowledged"]["packets_per_sec"], 2)
+    return results
+
+async def bench_external_stream(fps: float, seconds: float, lamps: int) -> dict:
+    """RGB frames from an external source at a fixed rate, fed like received datagrams."""
+    instances = await asyncio.gather(*[connected_instance(index) for index in range(lamps)])
+    stream = streaming.ColorStream(instances)
+    await stream.start(listen=False)
+    frames = int(fps * seconds)
+    for step in range(frames):
+        stream.feed(b"".join(bytes((index, step % 256, 64, 255 - step % 256)) for index in range(lamps)))
+        await asyncio.sleep(1 / fps)
+    stats = await stream.stop()
+    for instance in instances:
+        await instance.disconnect()
+    return {
+        "source_fps": fps,
+        "lamps": {mac: {key: lamp[key] for key in ("frames_sent", "frames_dropped", "fps")}
+                  | {"latency_p50_ms": lamp["latency_ms"]["p50"], "latency_p95_ms": lamp["latency_ms"]["p95"]}
+                  for mac, lamp in stats["lamps"].items()},
+    }
+
+async def bench_adapters(lamps: int, adapters: int, slots: int) -> dict:
+    """Lamps seen by several simulated adapters, connected through the default one vs. balanced.
+
+    Afterwards the adapter most lamps use loses signal and lamps migrate away from it.
+    """
+    rng = random.Random(1)
+    names = [f"sim{index}" for index in range(adapters)]
+    emulated = []
+    for index in range(lamps):
+        lamp = emulator.EMULATOR.add_lamp(f"EE:00:00:01:00:{index:02X}", adapter=names[0])
+        lamp.adapters = {name: rng.randint(-95, -50) for name in names}
+        emulated.append(lamp)
+
+    async def run(balanced: bool) -> tuple:
+        manager = connection.ConnectionManager(slots)
+        cache = scanner.ADVERTISEMENTS
+        cache._entries.clear()
+        cache._sources.clear()
+        if balanced:
+            emulator.EMULATOR.advertise(cache)
+        instances = []
+        for lamp in emulated:
+            instance = beurer.BeurerInstance(lamp.device, client_class=emulator.EmulatedBleakClient, **INSTANCE_SETTINGS)
+            instance._connections = manager
+            instance.set_update_callback(lambda: None)
+            instances.append(instance)
+        start = time.perf_counter()
+        await asyncio.gather(*[instance.connect() for instance in instances])
+        result = {
+            "wall_ms": round((time.perf_counter() - start) * 1000, 2),
+            "connect_median_ms": round(statistics.median(instance.metrics.connect.mean for instance in instances), 2),
+            "in_use": {name: stats["in_use"] for name, stats in manager.stats().items()},
+        }
+        return result, instances, manager
+
+    default, instances, _ = await run(False)
+    for instance in instances:
+        await instance.disconnect()
+    balanced, instances, manager = await run(True)
+    busiest = max(balanced["in_use"], key=balanced["in_use"].get)
+    for lamp in emulated:
+        lamp.adapters[busiest] = -98
+    emulator.EMULATOR.advertise(scanner.ADVERTISEMENTS)
+    migrated = sum(await asyncio.gather(*[instance.migrate_if_degraded() for instance in instances]))
+    balanced["after_degrading"] = {"adapter": busiest, "migrated": migrated,
+                                   "in_use": {name: stats["in_use"] for name, stats in manager.stats().items()}}
+    for instance in instances:
+        await instance.disconnect()
+    return {"default_adapter": default, "balanced": balanced}
+
+async def main(args) -> dict:
+    LAMP_SETTINGS.update(write_latency=args.write_latency, notify_latency=args.notify_latency,
+                         drop_rate=args.drop_rate, notify_on_change=args.notify_on_change, tx_buffer=args.tx_buffer)
+    connection.CONNECTIONS.slots = args.slots
+    INSTANCE_SETTINGS.update(optimistic=not args.no_optimistic, pipelined=not args.no_pipelining)
+    return {
+        "config": vars(args),
+        "operations": await bench_operations(args.repeat),
+        "slider_burst": await bench_slider_burst(args.burst, args.burst_interval),
+        "concurrent": await bench_concurrent(args.instances, args.adapters),
+        "streaming": await bench_streaming(args.stream_packets),
+        "external_stream": await bench_external_stream(args.source_fps, args.stream_seconds, args.stream_lamps),
+        "adapters": await bench_adapters(args.balance_lamps, args.balance_adapters, args.slots),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--write-latency", type=float, default=0.005, help="seconds per GATT write")
+    parser.add_argument("--notify-latency", type=float, default=0.01, help="seconds until a notification arrives")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="probability a notification is lost")
+    parser.add_argument("--notify-on-change", action="store_true", help="lamps report changes without a status request")
+    parser.add_argument("--no-optimistic", action="store_true", help="poll the status after every command")
+    parser.add_argument("--no-pipelining", action="store_true", help="wait for the acknowledgement of every write")
+    parser.add_argument("--tx-buffer", type=int, default=4, help="unacknowledged writes the emulated radio buffers")
+    parser.add_argument("--stream-packets", type=int, default=200, help="frames written in the streaming benchmark")
+    parser.add_argument("--source-fps", type=float, default=120, help="frame rate of the external stream source")
+    parser.add_argument("--stream-seconds", type=float, default=2)
+    parser.add_argument("--stream-lamps", type=int, default=3, help="lamps fed by the external stream")
+    parser.add_argument("--balance-lamps", type=int, default=12, help="lamps in the adapter balancing benchmark")
+    parser.add_argument("--balance-adapters", type=int, default=3, help="simulated adapters in the balancing benchmark")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--burst", type=int, default=50, help="set_color calls in the slider burst")
+    parser.add_argument("--burst-interval", type=float, default=0.01)
+    parser.add_argument("--instances", type=int, default=10)
+    parser.add_argument("--adapters", type=int, default=1)
+    parser.add_argument("--slots", type=int, default=10, help="connection slots per adapter")
+    parser.add_argument("--json", action="store_true", help="machine-readable output")
+    args = parser.parse_args()
+    results = asyncio.run(main(args))
+    print(json.dumps(results, indent=None if args.json else 2))
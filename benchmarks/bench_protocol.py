@@ -0,0 +1,59 @@
+"""Micro-benchmarks for frame encoding and notification parsing.
+
+Run from the repository root: python benchmarks/bench_protocol.py [--json]
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tl100 import protocol
+
+NUMBER = 200_000
+
+def legacy_encode(message):
+    """Frame building as done before the protocol module, for comparison."""
+    length = len(message)
+    checksum = length + 2
+    for byte in message:
+        checksum = checksum ^ byte
+    return [0xFE, 0xEF, 0x0A, length + 7, 0xAB, 0xAA, length + 2] + message + [checksum, 0x55, 0x0D, 0x0A]
+
+def legacy_send_path(message):
+    """The old sendPacket also hex formatted every frame for print and the debug log."""
+    packet = legacy_encode(message)
+    ''.join(format(x, ' 03x') for x in packet)
+    ''.join(format(x, ' 03x') for x in packet)
+    return packet
+
+def legacy_parse(res):
+    """Inline indexing as done in notification_handler before, for comparison."""
+    return (res[8], res[9] == 1, res[10], (res[13], res[14], res[15]), res[16])
+
+MOOD_REPLY = bytes([0xFE, 0xEF, 0x0A, 0x15, 0xAB, 0xAA, 0x10, 0x30, 0x02, 0x01, 0x32, 0x00, 0x00, 0xFF, 0x80, 0x00, 0x02, 0x00, 0x00, 0x55, 0x0D, 0x0A])
+
+CASES = {
+    "encode_status_cached": lambda: protocol.encode([0x30, 0x01]),
+    "encode_color": lambda: protocol.encode([0x32, 0xFF, 0x80, 0x00]),
+    "encode_brightness": lambda: protocol.encode([0x31, 0x02, 50]),
+    "legacy_encode_color": lambda: legacy_encode([0x32, 0xFF, 0x80, 0x00]),
+    "legacy_send_path_color": lambda: legacy_send_path([0x32, 0xFF, 0x80, 0x00]),
+    "parse_mood_reply": lambda: protocol.parse_notification(MOOD_REPLY),
+    "legacy_parse_mood_reply": lambda: legacy_parse(MOOD_REPLY),
+}
+
+def run(number: int = NUMBER) -> dict:
+    results = {}
+    for name, case in CASES.items():
+        seconds = min(timeit.repeat(case, number=number, repeat=3))
+        results[name] = {"ops_per_sec": round(number / seconds), "ns_per_op": round(seconds / number * 1e9, 1)}
+    return results
+
+if __name__ == "__main__":
+    results = run()
+    if "--json" in sys.argv:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, result in results.items():
+            print(f"{name:28} {result['ops_per_sec']:>12,} ops/s {result['ns_per_op']:>8} ns/op")
@@ -0,0 +1,51 @@
+"""Replay a recorded protocol trace against emulated lamps.
+
+Run from the repository root: python benchmarks/replay_trace.py TRACE [--speed 1] [--device MAC] [--dump] [--json]
+Record a trace by starting Home Assistant with BEURER_TRACE=<path>. Outbound frames go
+through the command path of a BeurerInstance per recorded device, recorded notifications
+through its notification_handler (the emulated lamps stay silent). Needs bleak installed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tl100 import beurer, emulator, recorder
+
+async def replay_device(device: bytes, records: list, speed: float) -> dict:
+    lamp = emulator.EMULATOR.add_lamp(recorder.format_device(device))
+    lamp.drop_rate = 1.0
+    instance = beurer.BeurerInstance(lamp.device, client_class=emulator.EmulatedBleakClient)
+    instance.set_update_callback(lambda: None)
+    await instance.connect()
+    stats = await recorder.replay(records, instance, speed)
+    await instance._window.drain()
+    await instance.disconnect()
+    result = stats.as_dict()
+    result["recorded_seconds"] = round(records[-1].time - records[0].time, 3)
+    return result
+
+async def main(args) -> dict:
+    by_device = {}
+    for record in recorder.read_trace(args.trace):
+        if args.device and recorder.format_device(record.device) != args.device.upper():
+            continue
+        if args.dump:
+            print(record)
+        by_device.setdefault(record.device, []).append(record)
+    #Lamps are replayed side by side like they ran
+    results = await asyncio.gather(*[replay_device(device, records, args.speed) for device, records in by_device.items()])
+    return {recorder.format_device(device): result for device, result in zip(by_device, results)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("trace", help="trace file written by the recorder")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor, 0 replays as fast as possible")
+    parser.add_argument("--device", help="only replay this device")
+    parser.add_argument("--dump", action="store_true", help="print the records")
+    parser.add_argument("--json", action="store_true", help="machine-readable output")
+    args = parser.parse_args()
+    results = asyncio.run(main(args))
+    print(json.dumps(results, indent=None if args.json else 2))
@@ -0,0 +1,147 @@
+"""Scan, query and set many Beurer lamps from the command line, without Home Assistant.
+
+Run from the repository root:
+    python cli.py scan [--timeout 5]
+    python cli.py query [MAC ...] [--all] [--timeout 5]
+    python cli.py set [MAC ...] [--all] [--timeout 5] [--off] [--rgb 255,0,0] [--brightness 128] [--white 200] [--effect Rainbow]
+Lamps are handled concurrently (--concurrency connects at a time), --emulate N uses
+emulated lamps instead of bluetooth and --json prints machine-readable results.
+Only the tl100 package is imported, it does not need Home Assistant.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from tl100 import beurer, emulator, group, scanner
+from tl100.const import EFFECTS
+
+def _round(value):
+    return round(value, 1) if value is not None else None
+
+def parse_rgb(value: str) -> tuple:
+    rgb = tuple(int(part) for part in value.split(","))
+    if len(rgb) != 3 or not all(0 <= part <= 255 for part in rgb):
+        raise argparse.ArgumentTypeError("expected R,G,B with values 0-255")
+    return rgb
+
+async def scan(args) -> list[dict]:
+    devices = await scanner.ADVERTISEMENTS.async_discover(beurer.is_supported, args.timeout, count=None)
+    results = []
+    for device in devices:
+        entry = scanner.ADVERTISEMENTS.get(device.address)
+        results.append({"mac": device.address, "name": device.name, "rssi": entry.rssi if entry else None})
+    return sorted(results, key=lambda result: result["mac"])
+
+async def targets(args) -> list:
+    """BeurerInstances of the given MACs, or of all lamps found with --all."""
+    macs = list(args.mac)
+    if args.all:
+        macs += [device["mac"] for device in await scan(args) if device["mac"] not in macs]
+    devices = await asyncio.gather(*[beurer.get_device(mac) for mac in macs])
+    instances = []
+    for mac, device in zip(macs, devices):
+        #Commands are verified right away, there is no later poll in a short lived process
+        instance = beurer.BeurerInstance(device or mac, optimistic=False)
+        instance.set_update_callback(lambda: None)
+        instances.append(instance)
+    return instances
+
+async def query(args) -> list[dict]:
+    instances = await targets(args)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def query_one(instance) -> dict:
+        async with semaphore:
+            start = time.monotonic()
+            connected = await instance.connect()
+            result = {"mac": instance.mac, "connected": connected,
+                      "connect_ms": _round((time.monotonic() - start) * 1000)}
+            if connected:
+                result["state"] = instance.state_snapshot()
+                result["reply_rtt_ms"] = _round(instance.metrics.reply_rtt.mean)
+            else:
+                result["error"] = "not found" if not instance.is_ready else instance.connection_state.value
+            await instance.close()
+            return result
+    return await asyncio.gather(*[query_one(instance) for instance in instances])
+
+async def set_state(args) -> dict:
+    instances = await targets(args)
+    results = await group.set_group(instances, args.concurrency, not args.off, white_brightness=args.white,
+                                    rgb_color=args.rgb, color_brightness=args.brightness, effect=args.effect)
+    for instance in instances:
+        await instance.close()
+    window = group.spread(results)
+    latencies = [result.latency * 1000 for result in results if result.success]
+    return {
+        "lamps": {result.mac: result.as_dict() for result in results},
+        "succeeded": len(latencies),
+        "latency_median_ms": _round(statistics.median(latencies)) if latencies else None,
+        "spread_ms": _round(window * 1000) if window is not None else None,
+    }
+
+async def main(args):
+    if args.emulate:
+        os.environ["BEURER_EMULATOR"] = str(args.emulate)
+        emulator.install_from_env(scanner.ADVERTISEMENTS)
+        emulator.EMULATOR.advertise(scanner.ADVERTISEMENTS)
+    try:
+        return await COMMANDS[args.command](args)
+    finally:
+        await scanner.ADVERTISEMENTS.async_stop()
+
+def print_results(command: str, results):
+    if command == "scan":
+        for device in results:
+            print(f"{device['mac']}  {device['rssi'] if device['rssi'] is not None else '':>4}  {device['name']}")
+    elif command == "query":
+        for result in results:
+            if result["connected"]:
+                state = result["state"]
+                print(f"{result['mac']}  on={state['is_on']} mode={state['mode']} rgb={state['rgb_color']} "
+                      f"brightness={state['color_brightness']} white={state['brightness']} effect={state['effect']}  "
+                      f"connect={result['connect_ms']}ms rtt={result['reply_rtt_ms']}ms")
+            else:
+                print(f"{result['mac']}  {result['error']}  connect={result['connect_ms']}ms")
+    else:
+        for mac, result in results["lamps"].items():
+            print(f"{mac}  {'ok' if result['success'] else result['error']}  latency={result['latency_ms']}ms packets={result['packets']}")
+        print(f"{results['succeeded']}/{len(results['lamps'])} lamps, median latency {results['latency_median_ms']}ms, "
+              f"spread {results['spread_ms']}ms")
+
+COMMANDS = {"scan": scan, "query": query, "set": set_state}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", action="store_true", help="machine-readable output")
+    parser.add_argument("--emulate", type=int, default=0, metavar="N", help="use N emulated lamps")
+    parser.add_argument("--debug", action="store_true", help="debug logging")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("scan", help="list lamps in range")
+    command.add_argument("--timeout", type=float, default=5, help="seconds to scan")
+    for name, help in (("query", "connect and print the state of lamps"), ("set", "set the state of lamps at once")):
+        command = commands.add_parser(name, help=help)
+        command.add_argument("mac", nargs="*", help="lamp addresses")
+        command.add_argument("--all", action="store_true", help="all lamps found by a scan")
+        command.add_argument("--concurrency", type=int, default=5, help="lamps connected at a time")
+        command.add_argument("--timeout", type=float, default=5, help="seconds to scan for --all")
+    command.add_argument("--off", action="store_true", help="turn the lamps off")
+    command.add_argument("--rgb", type=parse_rgb, help="mood light color R,G,B")
+    command.add_argument("--brightness", type=int, help="mood light brightness 1-255")
+    command.add_argument("--white", type=int, help="white light brightness 1-255")
+    command.add_argument("--effect", choices=EFFECTS, help="mood light effect, Off stops a running effect")
+    args = parser.parse_args()
+    if args.command != "scan" and not args.mac and not args.all:
+        parser.error("give lamp addresses or --all")
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+    results = asyncio.run(main(args))
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print_results(args.command, results)
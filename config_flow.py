@@ -1,13 +1,17 @@
 import asyncio
-from .beurer import discover, get_device, BeurerInstance
+from .tl100.beurer import discover, get_device, BeurerInstance
 from typing import Any
 
 from homeassistant import config_entries
 from homeassistant.const import CONF_MAC
 import voluptuous as vol
 from homeassistant.helpers.device_registry import format_mac
+from homeassistant.components.bluetooth import BluetoothServiceInfoBleak
 
-from .const import DOMAIN, LOGGER
+from .const import DOMAIN, LOGGER, SETUP_DISCOVERY_TIMEOUT
+from .tl100.emulator import install_from_env
+from .tl100.scanner import ADVERTISEMENTS
+from . import async_attach_bluetooth
 
 DATA_SCHEMA = vol.Schema({("host"): str})
 
@@ -34,8 +38,12 @@ class BeurerFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
             return await self.async_step_validate()
 
         already_configured = self._async_current_ids(False)
-        devices = await discover()
-        devices = [device for device in devices if format_mac(device.address) not in already_configured]
+        install_from_env(ADVERTISEMENTS)
+        #Attach before discovering, an own scanner started now would otherwise stay for the session
+        await async_attach_bluetooth(self.hass)
+        #Lists every unconfigured lamp seen within a short window, not just the first one
+        devices = await discover(count=None, exclude={mac for mac in already_configured if mac},
+                                 timeout=SETUP_DISCOVERY_TIMEOUT)
 
         if not devices:
             return await self.async_step_manual()
@@ -54,6 +62,28 @@ class BeurerFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
             ),
             errors={})
 
+    async def async_step_bluetooth(self, discovery_info: BluetoothServiceInfoBleak):
+        """Handle a lamp found by Home Assistant's bluetooth integration."""
+        await self.async_set_unique_id(format_mac(discovery_info.address))
+        self._abort_if_unique_id_configured()
+        ADVERTISEMENTS.update(discovery_info.device, discovery_info.advertisement, discovery_info.rssi)
+        self.mac = discovery_info.address
+        self.name = discovery_info.name
+        self.context["title_placeholders"] = {"name": self.name}
+        return await self.async_step_bluetooth_confirm()
+
+    async def async_step_bluetooth_confirm(self, user_input: "dict[str, Any] | None" = None):
+        if user_input is not None:
+            self.name = user_input["name"]
+            return await self.async_step_validate()
+
+        return self.async_show_form(
+            step_id="bluetooth_confirm", data_schema=vol.Schema(
+                {
+                    vol.Required("name", default=self.name): str
+                }
+            ), description_placeholders={"name": self.name}, errors={})
+
     async def async_step_validate(self, user_input: "dict[str, Any] | None" = None):
         if user_input is not None:
             if "flicker" in user_input:
@@ -97,8 +127,9 @@ class BeurerFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
             ), errors={})
 
     async def toggle_light(self):
-        if not self.beurer_instance:
-            self.beurer_instance = BeurerInstance(await get_device(self.mac))
+        await async_attach_bluetooth(self.hass)
+        if not self.beurer_instance or not self.beurer_instance.is_ready:
+            self.beurer_instance = BeurerInstance(await get_device(self.mac) or self.mac)
         try:
             LOGGER.debug("Going to update from config flow")
             await self.beurer_instance.update()
@@ -115,4 +146,4 @@ class BeurerFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
             LOGGER.error(f"Error while toggling light: {error}")
             return error
         finally:
-            await self.beurer_instance.disconnect()
\ No newline at end of file
+            await self.beurer_instance.close()
\ No newline at end of file
@@ -1,4 +1,11 @@
-import logging
+from .tl100.const import LOGGER
 
-LOGGER = logging.getLogger('custom_components.beurer')
-DOMAIN = "beurer"
\ No newline at end of file
+DOMAIN = "beurer"
+DATA_DETACH_BLUETOOTH = f"{DOMAIN}_detach_bluetooth"
+DATA_STREAM = f"{DOMAIN}_stream"
+
+#Seconds over which lamps spread their first connect after Home Assistant started
+STARTUP_CONNECT_SPREAD = 10
+
+#Seconds the config flow listens for lamps, already cached advertisements are listed immediately
+SETUP_DISCOVERY_TIMEOUT = 2
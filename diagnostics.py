@@ -0,0 +1,23 @@
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN
+from .tl100.connection import CONNECTIONS
+from .tl100.probe import PROBES
+
+TO_REDACT = {"mac"}
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict[str, Any]:
+    """Return diagnostics for a config entry."""
+    instance = hass.data[DOMAIN][entry.entry_id]
+    return {
+        "entry": async_redact_data(dict(entry.data), TO_REDACT),
+        "device": async_redact_data(instance.diagnostics(), TO_REDACT),
+        "adapters": CONNECTIONS.stats(),
+        "probes": PROBES.entry_stats(instance),
+    }
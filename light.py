@@ -1,16 +1,18 @@
 import logging
+import random
 import voluptuous as vol
 from typing import Any, Optional, Tuple
 
-from .beurer import BeurerInstance
-from .const import DOMAIN
+from .tl100.beurer import BeurerInstance
+from .const import DOMAIN, STARTUP_CONNECT_SPREAD
 
 from homeassistant.const import CONF_MAC
 import homeassistant.helpers.config_validation as cv
 from homeassistant.components.light import (COLOR_MODE_RGB, PLATFORM_SCHEMA,
-                                            LightEntity, ATTR_RGB_COLOR, ATTR_BRIGHTNESS, ATTR_EFFECT, COLOR_MODE_WHITE, ATTR_WHITE, LightEntityFeature)
+                                            LightEntity, ATTR_RGB_COLOR, ATTR_BRIGHTNESS, ATTR_EFFECT, ATTR_TRANSITION, COLOR_MODE_WHITE, ATTR_WHITE, LightEntityFeature)
 from homeassistant.util.color import (match_max_scale)
 from homeassistant.helpers import device_registry
+from homeassistant.helpers.restore_state import ExtraStoredData, RestoreEntity, RestoredExtraData
 from .const import LOGGER
 
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
@@ -22,7 +24,7 @@ async def async_setup_entry(hass, config_entry, async_add_devices):
     instance = hass.data[DOMAIN][config_entry.entry_id]
     async_add_devices([BeurerLight(instance, config_entry.data["name"], config_entry.entry_id)])
 
-class BeurerLight(LightEntity):
+class BeurerLight(RestoreEntity, LightEntity):
     def __init__(self, beurerInstance: BeurerInstance, name: str, entry_id: str) -> None:
         self._instance = beurerInstance
         self._entry_id = entry_id
@@ -32,18 +34,28 @@ class BeurerLight(LightEntity):
         self._attr_unique_id = self._instance.mac
 
     async def async_added_to_hass(self) -> None:
-        """Add update callback after being added to hass."""
+        """Add update callback after being added to hass.
+
+        The last known state is shown right away, the lamp is connected in the background
+        (spread over a few seconds so many lamps do not connect at once) or by the first command.
+        """
         self._instance.set_update_callback(self.update_callback)
-        await self._instance.update()
+        last = await self.async_get_last_extra_data()
+        if last is not None:
+            self._instance.restore_state(last.as_dict())
+        self._instance.connect_later(random.uniform(0, STARTUP_CONNECT_SPREAD))
+
+    @property
+    def extra_restore_state_data(self) -> ExtraStoredData:
+        return RestoredExtraData(self._instance.state_snapshot())
 
     def update_callback(self) -> None:
-        """Schedule a state update."""
-        #self.async_schedule_update_ha_state(False)
-        self.schedule_update_ha_state(False)
+        """Write the state, called from the event loop by the instance once per changed state."""
+        self.async_write_ha_state()
 
     @property
     def available(self):
-        return self._instance.is_on != None
+        return self._instance.is_ready and self._instance.is_on != None
 
     #We handle update triggers manually, do not poll
     @property
@@ -82,7 +94,7 @@ class BeurerLight(LightEntity):
 
     @property
     def supported_features(self):
-        return LightEntityFeature.EFFECT
+        return LightEntityFeature.EFFECT | LightEntityFeature.TRANSITION
 
     @property
     def color_mode(self):
@@ -105,24 +117,33 @@ class BeurerLight(LightEntity):
 
     async def async_turn_on(self, **kwargs: Any) -> None:
         LOGGER.debug(f"Turning light on with args: {kwargs}")
-        #if not self.is_on:
-        #    await self._instance.turn_on()
-        if len(kwargs) == 0:
-            await self._instance.turn_on()
-
-        if ATTR_BRIGHTNESS in kwargs and kwargs[ATTR_BRIGHTNESS]:
-            await self._instance.set_white(kwargs[ATTR_BRIGHTNESS])
-
-        if ATTR_RGB_COLOR in kwargs and kwargs[ATTR_RGB_COLOR]:
-            color = kwargs[ATTR_RGB_COLOR]
-            await self._instance.set_color(color)
-
-        if ATTR_EFFECT in kwargs and kwargs[ATTR_EFFECT]:
-           await self._instance.set_effect(kwargs[ATTR_EFFECT])
+        rgb_color = kwargs.get(ATTR_RGB_COLOR) or None
+        effect = kwargs.get(ATTR_EFFECT) or None
+        brightness = kwargs.get(ATTR_BRIGHTNESS) or None
+        #Brightness goes to the mood light when a color or effect is requested or it is the active mode, otherwise to white
+        white = rgb_color is None and effect is None and self._instance.color_mode != COLOR_MODE_RGB
+        if kwargs.get(ATTR_TRANSITION) and effect is None:
+            #Fades run in the background, the next command cancels them
+            self._instance.start_transition(kwargs[ATTR_TRANSITION], white=white, rgb_color=rgb_color,
+                                            brightness=brightness)
+            return
+        #All requested attributes are sent as one transaction with a single status check
+        with self._instance.metrics.service_call_timer():
+            report = await self._instance.apply_state(
+                white_brightness=brightness if white else None,
+                rgb_color=rgb_color,
+                color_brightness=None if white else brightness,
+                effect=effect)
+        if report is not None:
+            LOGGER.debug(f"Turn on sent {report.total_packets} packets")
 
 
     async def async_turn_off(self, **kwargs: Any) -> None:
-        await self._instance.turn_off()
+        if kwargs.get(ATTR_TRANSITION) and self._instance.is_on:
+            self._instance.start_transition(kwargs[ATTR_TRANSITION], white=self._instance.color_mode == COLOR_MODE_WHITE, off=True)
+            return
+        with self._instance.metrics.service_call_timer():
+            await self._instance.turn_off()
 
     async def async_update(self) -> None:
         await self._instance.update()
@@ -0,0 +1,60 @@
+from typing import Callable, Optional
+
+from homeassistant.components.sensor import SensorEntity, SensorStateClass
+from homeassistant.const import UnitOfTime
+from homeassistant.helpers import device_registry
+from homeassistant.helpers.entity import EntityCategory
+
+from .tl100.beurer import BeurerInstance
+from .const import DOMAIN, LOGGER
+
+#key, name, unit, state class, value
+SENSORS: list[tuple[str, str, Optional[str], SensorStateClass, Callable[[BeurerInstance], Optional[float]]]] = [
+    ("write_latency", "Write latency", UnitOfTime.MILLISECONDS, SensorStateClass.MEASUREMENT, lambda instance: instance.metrics.write.mean),
+    ("reply_rtt", "Status round trip", UnitOfTime.MILLISECONDS, SensorStateClass.MEASUREMENT, lambda instance: instance.metrics.reply_rtt.mean),
+    ("connect_duration", "Connect duration", UnitOfTime.MILLISECONDS, SensorStateClass.MEASUREMENT, lambda instance: instance.metrics.connect.mean),
+    ("reconnects", "Reconnects", None, SensorStateClass.TOTAL_INCREASING, lambda instance: instance.metrics.reconnects),
+    ("connect_failures", "Connect failures", None, SensorStateClass.TOTAL_INCREASING, lambda instance: instance.metrics.connect_failures),
+    ("packets_per_call", "Packets per call", None, SensorStateClass.MEASUREMENT, lambda instance: instance.metrics.packets_per_call.mean),
+    ("command_wait", "Command wait", UnitOfTime.MILLISECONDS, SensorStateClass.MEASUREMENT, lambda instance: instance.metrics.command_wait.mean),
+    ("command_queue_depth", "Command queue depth", None, SensorStateClass.MEASUREMENT, lambda instance: instance.command_queue_depth),
+]
+
+async def async_setup_entry(hass, config_entry, async_add_devices):
+    LOGGER.debug(f"Setting up device from sensor")
+    instance = hass.data[DOMAIN][config_entry.entry_id]
+    async_add_devices([BeurerDiagnosticSensor(instance, config_entry.data["name"], *sensor) for sensor in SENSORS])
+
+class BeurerDiagnosticSensor(SensorEntity):
+    """Performance counter of a lamp, disabled by default."""
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_entity_registry_enabled_default = False
+
+    def __init__(self, beurerInstance: BeurerInstance, name: str, key: str, sensor_name: str,
+                 unit: Optional[str], state_class: SensorStateClass, value: Callable[[BeurerInstance], Optional[float]]) -> None:
+        self._instance = beurerInstance
+        self._value = value
+        self._attr_name = f"{name} {sensor_name}"
+        self._attr_unique_id = f"{self._instance.mac}_{key}"
+        self._attr_native_unit_of_measurement = unit
+        #Counters only grow until Home Assistant restarts, the others are averages or snapshots
+        self._attr_state_class = state_class
+
+    #Values are read from memory, polling does not touch the device
+    @property
+    def should_poll(self) -> Optional[bool]:
+        return True
+
+    @property
+    def native_value(self):
+        value = self._value(self._instance)
+        return round(value, 1) if isinstance(value, float) else value
+
+    @property
+    def device_info(self):
+        return {
+            "identifiers": {
+                (DOMAIN, self._instance.mac)
+            },
+            "connections": {(device_registry.CONNECTION_NETWORK_MAC, self._instance.mac)}
+        }
@@ -0,0 +1,5 @@
+"""The tests use the tl100 package directly, like cli.py and the benchmarks, and need bleak installed."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
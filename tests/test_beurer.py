@@ -0,0 +1,106 @@
+"""BeurerInstance against emulated lamps."""
+import asyncio
+import itertools
+
+from tl100 import beurer, connection, emulator, protocol, scanner
+
+_addresses = itertools.count(1)
+
+def emulated_lamp(**settings) -> emulator.EmulatedLamp:
+    #Lamps and advertisements are shared by the whole session, each test uses new addresses
+    lamp = emulator.EMULATOR.add_lamp(f"EE:00:00:02:00:{next(_addresses):02X}")
+    for name, value in settings.items():
+        setattr(lamp, name, value)
+    return lamp
+
+def instance_of(lamp: emulator.EmulatedLamp, **settings) -> beurer.BeurerInstance:
+    instance = beurer.BeurerInstance(lamp.device, client_class=emulator.EmulatedBleakClient, **settings)
+    instance.set_update_callback(lambda: None)
+    return instance
+
+def test_plan_state_sends_only_changes():
+    async def run():
+        instance = instance_of(emulated_lamp())
+        instance._light_on, instance._brightness = True, 128
+        instance._color_on, instance._effect, instance._rgb_color, instance._color_brightness = True, "Off", (255, 0, 0), 255
+        assert instance.plan_state(white_brightness=128) == []
+        assert instance.plan_state(rgb_color=(0, 255, 0)) == [[0x32, 0, 255, 0]]
+        assert instance.plan_state(rgb_color=(255, 0, 0), effect="Rainbow") == [[0x34, 2]]
+        assert instance.plan_state(on=False) == [[0x35, 0x01], [0x35, 0x02]]
+        instance._light_on = False
+        assert instance.plan_state(on=False) == [[0x35, 0x02]]
+    asyncio.run(run())
+
+def test_plan_state_restores_mood_light_when_powering_on():
+    async def run():
+        instance = instance_of(emulated_lamp())
+        instance._color_on, instance._effect, instance._rgb_color, instance._color_brightness = False, "Off", (0, 0, 255), 255
+        #The lamp starts in rainbow mode, so effect, color and brightness are all sent
+        assert instance.plan_state(rgb_color=(0, 0, 255)) == [[0x37, 0x02], [0x34, 0], [0x32, 0, 0, 255], [0x31, 0x02, 100]]
+    asyncio.run(run())
+
+def test_apply_state_reaches_the_planned_state():
+    async def run():
+        lamp = emulated_lamp()
+        instance = instance_of(lamp)
+        await instance.connect()
+        report = await instance.apply_state(rgb_color=(0, 255, 0), effect="Off", color_brightness=255)
+        await instance._window.drain()
+        assert report.total_packets == len(report.commands)
+        assert lamp.mood.on and lamp.mood.rgb == (0, 255, 0) and lamp.mood.effect == 0
+        await instance.close()
+    asyncio.run(run())
+
+def test_turn_off_preempts_a_restore():
+    async def run():
+        lamp = emulated_lamp(write_latency=0.05)
+        instance = instance_of(lamp, optimistic=False)
+        await instance.connect()
+        instance._mode = beurer.COLOR_MODE_RGB
+        instance._color_on, instance._effect, instance._rgb_color, instance._color_brightness = False, "Off", (255, 0, 0), 255
+        #The restore waits for a reply per step, turn_off arrives while it runs
+        restore = asyncio.create_task(instance.turn_on())
+        await asyncio.sleep(0.08)
+        await instance.turn_off()
+        assert await restore is None
+        await instance._window.drain()
+        assert not lamp.white.on and not lamp.mood.on
+        assert instance.metrics.commands_cancelled == 1
+        await instance.close()
+    asyncio.run(run())
+
+def test_lamp_migrates_when_its_adapter_degrades():
+    async def run():
+        lamp = emulated_lamp()
+        lamp.adapters = {"near": -55, "far": -75}
+        scanner.ADVERTISEMENTS.update(lamp.device_via("near"), rssi=-55)
+        scanner.ADVERTISEMENTS.update(lamp.device_via("far"), rssi=-75)
+        instance = instance_of(lamp)
+        instance._connections = connection.ConnectionManager()
+        await instance.connect()
+        assert instance._connections.adapter_of(instance) == "near"
+        assert not await instance.migrate_if_degraded()
+        lamp.adapters["near"] = -98
+        scanner.ADVERTISEMENTS.update(lamp.device_via("near"), rssi=-98)
+        assert await instance.migrate_if_degraded()
+        assert instance._connections.adapter_of(instance) == "far"
+        assert instance.migrations == 1 and lamp.connected
+        await instance.close()
+    asyncio.run(run())
+
+def test_queued_commands_of_the_same_kind_merge():
+    async def run():
+        lamp = emulated_lamp(write_latency=0.02)
+        instance = instance_of(lamp)
+        await instance.connect()
+        await instance.set_color((1, 1, 1))
+        await instance._window.drain()
+        sent = len(lamp.frames)
+        #Like a dragged slider, only the latest of the queued colors is sent
+        await asyncio.gather(*[instance.set_color((index, 0, 0)) for index in range(10, 20)])
+        await instance._window.drain()
+        colors = [frame for frame in lamp.frames[sent:] if frame[7] == protocol.COLOR]
+        assert instance.metrics.commands_merged == 9 and len(colors) == 1
+        assert lamp.mood.rgb == (19, 0, 0)
+        await instance.close()
+    asyncio.run(run())
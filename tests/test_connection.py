@@ -0,0 +1,45 @@
+"""Connection helpers without a device."""
+import asyncio
+import time
+
+from tl100.connection import Backoff, WriteWindow
+
+def test_backoff_doubles_up_to_the_maximum():
+    backoff = Backoff(initial=2, maximum=10)
+    delays = [backoff.fail() for _ in range(5)]
+    #Equal jitter keeps each delay within the upper half of its step
+    for delay, step in zip(delays, (2, 4, 8, 10, 10)):
+        assert step / 2 <= delay <= step
+    backoff.reset()
+    assert backoff.failures == 0 and backoff.remaining == 0
+
+def test_advertisement_shortens_backoff_once():
+    backoff = Backoff(initial=2, maximum=300)
+    for _ in range(8):
+        backoff.fail()
+    assert backoff.remaining > 60
+    backoff.shorten(time.monotonic())
+    assert backoff.remaining <= 2
+    #Further advertisements before the next failure do not move the retry again
+    retry_at = backoff.retry_at
+    backoff.shorten(time.monotonic() - 10)
+    assert backoff.retry_at == retry_at
+    backoff.fail()
+    assert not backoff.shortened
+
+def test_write_window_bounds_writes_in_flight():
+    async def run():
+        window = WriteWindow(limit=2)
+        in_flight = 0
+        most = 0
+        async def write():
+            nonlocal in_flight, most
+            in_flight += 1
+            most = max(most, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+        for _ in range(6):
+            await window.submit(write)
+        await window.drain()
+        assert most <= 2 and in_flight == 0
+    asyncio.run(run())
@@ -0,0 +1,5 @@
+"""Protocol core of the Beurer TL100 lamps: commands, connections, scanning and tools.
+
+It only depends on bleak. The Home Assistant integration in the parent package is a
+thin adapter around it, and cli.py and the benchmarks use it without Home Assistant.
+"""
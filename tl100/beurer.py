@@ -0,0 +1,1109 @@
+from typing import Any, Awaitable, Optional, Tuple, Callable, Union
+from dataclasses import dataclass, field
+from bleak import BleakClient, BLEDevice, BleakGATTCharacteristic, BleakError
+import traceback
+import asyncio
+import contextvars
+import functools
+import heapq
+import logging
+import itertools
+import time
+from collections import deque
+
+from .const import (COLOR_MODE_RGB, COLOR_MODE_WHITE, EFFECTS, LOGGER, OPTIMISTIC_UPDATES, VERIFY_DELAY, PIPELINED_WRITES, DISCOVERY_TIMEOUT, BACKOFF_MAX,
+                    MIGRATE_MARGIN)
+from .scanner import ADVERTISEMENTS
+from . import protocol
+from .metrics import DeviceMetrics
+from .transition import run_transition
+from .recorder import INBOUND, OUTBOUND, device_id
+from .probe import PROBES
+from .connection import CONNECTIONS, Backoff, ConnectionState, DeviceUnavailable, WriteWindow, adapter_of
+
+WRITE_CHARACTERISTIC_UUIDS = ["8b00ace7-eb0b-49b0-bbe9-9aee0a26e1a3"]
+READ_CHARACTERISTIC_UUIDS  = ["0734594a-a8e7-4b1a-a6b1-cd5243059a57"]
+
+#Client used when no client_class is given, replaced by the emulator
+CLIENT_CLASS = BleakClient
+#TraceRecorder new instances record their frames to, see recorder.install_from_env
+RECORDER = None
+
+def is_supported(device: BLEDevice) -> bool:
+    return bool(device.name) and device.name.lower().startswith("tl100")
+
+async def discover(count: Optional[int] = 1, mac: Optional[str] = None, exclude: set = frozenset(),
+                   timeout: float = DISCOVERY_TIMEOUT) -> list[BLEDevice]:
+    """Discover supported devices, returning as soon as count new ones or the one with the MAC were seen.
+
+    Devices with a (lower case) address in exclude are ignored, e.g. the configured ones.
+    """
+    match = lambda device: is_supported(device) and device.address.lower() not in exclude
+    devices = await ADVERTISEMENTS.async_discover(match, timeout, count, mac)
+    LOGGER.debug("Discovered devices: %s", [{"address": device.address, "name": device.name} for device in devices])
+    return devices
+    
+def create_status_callback(future: asyncio.Future):
+    def callback(sender: int, data: bytearray):
+        if not future.done():
+            future.set_result(data)
+    return callback
+
+async def get_device(mac: str) -> BLEDevice:
+    device = await ADVERTISEMENTS.async_get_device(mac)
+    LOGGER.debug(f"Found device for {mac}: {device}")
+    return device
+
+#Any status notification, used to detect that the device processed a command
+REPLY_ANY = (1, 2, 255)
+
+#State-critical commands (off, on) are always written with acknowledgement
+ACKNOWLEDGED_OPCODES = (0x35, 0x37)
+
+#Priorities of logical commands, lower runs first
+PRIORITY_POWER_OFF = 0
+PRIORITY_NORMAL = 1
+
+#(instance, submitting task) of the logical command the current task runs
+_COMMAND: contextvars.ContextVar = contextvars.ContextVar("beurer_command", default=(None, None))
+
+class CommandExecutor:
+    """Runs the logical commands (multi packet sequences) of one device one at a time.
+
+    Commands run by priority, then in submission order. A preempting command cancels
+    running and queued commands of lower priority, a command with the same merge key
+    as a queued one replaces it (e.g. slider drags). Callers of dropped commands get None.
+    """
+    def __init__(self, owner: Any, metrics: "DeviceMetrics") -> None:
+        self._owner = owner
+        self._metrics = metrics
+        self._queue: list = []
+        self._order = itertools.count()
+        self._running = None
+        self._worker = None
+
+    @property
+    def depth(self) -> int:
+        return sum(1 for entry in self._queue if not entry[4].done()) + (1 if self._running else 0)
+
+    async def run(self, operation: Callable[[], Awaitable], priority: int = PRIORITY_NORMAL, preempt: bool = False,
+                  name: str = "", key: Any = None):
+        if preempt:
+            self._cancel_below(priority)
+        if key is not None:
+            for entry in self._queue:
+                if entry[7] == key and not entry[4].done():
+                    entry[4].set_result(None)
+                    self._metrics.commands_merged += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._order), name, operation, future, time.monotonic(), asyncio.current_task(), key))
+        self._metrics.command_queue_max = max(self._metrics.command_queue_max, self.depth)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._work())
+        return await future
+
+    def _cancel_below(self, priority: int):
+        for entry in self._queue:
+            if entry[0] > priority and not entry[4].done():
+                LOGGER.debug(f"Dropping queued {entry[2]}")
+                entry[4].set_result(None)
+                self._metrics.commands_cancelled += 1
+        if self._running and self._running[0] > priority:
+            LOGGER.debug(f"Cancelling running {self._running[1]}")
+            self._running[2].cancel()
+
+    async def _execute(self, operation: Callable[[], Awaitable], origin):
+        _COMMAND.set((self._owner, origin))
+        return await operation()
+
+    async def _work(self):
+        while self._queue:
+            priority, _, name, operation, future, queued_at, origin, _ = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            self._metrics.command_wait.record((time.monotonic() - queued_at) * 1000)
+            task = asyncio.create_task(self._execute(operation, origin))
+            self._running = (priority, name, task)
+            try:
+                await asyncio.wait([task])
+            finally:
+                self._running = None
+            if future.done():
+                continue
+            if task.cancelled():
+                self._metrics.commands_cancelled += 1
+                future.set_result(None)
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+
+    def stats(self) -> dict:
+        return {"depth": self.depth, "running": self._running[1] if self._running else None}
+
+def _merge_key(name: str, args: tuple, kwargs: dict) -> tuple:
+    """Commands setting the same attributes (values aside, except flags like on) replace each other."""
+    shape = lambda value: value if isinstance(value, bool) or value is None else True
+    return (name, tuple(map(shape, args)), tuple(sorted((key, shape(value)) for key, value in kwargs.items())))
+
+def serialized(priority: int = PRIORITY_NORMAL, preempt: bool = False):
+    """Run a BeurerInstance method as one logical command through its CommandExecutor.
+
+    Calls from within a running command of the same device (e.g. set_color calling
+    turn_on) are part of that command and run directly.
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            if _COMMAND.get()[0] is self:
+                return await method(self, *args, **kwargs)
+            return await self._executor.run(lambda: method(self, *args, **kwargs), priority, preempt, method.__name__,
+                                            _merge_key(method.__name__, args, kwargs))
+        return wrapper
+    return decorate
+
+def to_percent(value: int) -> int:
+    """Convert a 0-255 Home Assistant brightness to the 0-100 the lamp uses."""
+    return int(value/255*100)
+
+@dataclass
+class TransactionReport:
+    """Packets sent by a single state transaction."""
+    commands: list = field(default_factory=list)
+    status_packets: int = 0
+
+    @property
+    def command_packets(self) -> int:
+        return len(self.commands)
+
+    @property
+    def total_packets(self) -> int:
+        return self.command_packets + self.status_packets
+
+class BeurerInstance:
+    def __init__(self, device: Union[BLEDevice, str], client_class: Optional[Callable] = None,
+                 optimistic: bool = OPTIMISTIC_UPDATES, verify_delay: float = VERIFY_DELAY, pipelined: bool = PIPELINED_WRITES) -> None:
+        #A MAC address instead of a device creates an instance which is not ready until resolve_device found it
+        self._mac = device if isinstance(device, str) else device.address
+        self._ble_device = None if isinstance(device, str) else device
+        #client_class allows a stand-in for BleakClient, e.g. the emulator
+        self._client_class = client_class or CLIENT_CLASS
+        self._device = self._client_class(device,  disconnected_callback=self.disconnected_callback)
+        self._ready = asyncio.Event()
+        if self._ble_device is not None:
+            self._ready.set()
+        self._resolver = None
+        self._connections = CONNECTIONS
+        self._idle_disconnect = False
+        self._state = ConnectionState.DISCONNECTED
+        self._state_history = deque(maxlen=20)
+        self._state_listeners: list[Callable] = []
+        self._backoff = Backoff()
+        self._connecting = None
+        self._metrics = DeviceMetrics()
+        #Optimistic mode applies commands locally and verifies them in one status poll once commands stop
+        self._optimistic = optimistic
+        self._verify_delay = verify_delay
+        self._verify_handle = None
+        self._verify_task = None
+        self._generation = 0
+        self._publish_scheduled = False
+        self._last_published = None
+        self._transition = None
+        self._last_transition_stats = None
+        #Pipelined writes do not wait for the GATT acknowledgement, see _write
+        self._pipelined = pipelined
+        self._write_without_response = False
+        self._window = WriteWindow()
+        self._connect_handle = None
+        self._streaming = False
+        self._last_notification = 0.0
+        self._released = False
+        self._recorder = RECORDER
+        #RSSI of the lamp at the adapter it connected through
+        self._adapter_rssi = None
+        self.migrations = 0
+        self._device_id = device_id(self._mac)
+        self._trigger_update = None
+        self._is_on = False
+        self._light_on = None
+        self._color_on = None
+        self._rgb_color = (0,0,0)
+        self._brightness = None
+        self._color_brightness = None
+        self._effect = None
+        self._write_uuid = None
+        self._read_uuid = None
+        self._mode = None
+        self._supported_effects = list(EFFECTS)
+        self._executor = CommandExecutor(self, self._metrics)
+        self._reply_waiters: dict[int, list[Callable]] = {}
+        self._last_transaction = None
+
+    def _expect_reply(self, versions: Tuple[int, ...]) -> asyncio.Future:
+        """Register a future which resolves with the next notification of one of the reply versions."""
+        future = asyncio.get_running_loop().create_future()
+        callback = create_status_callback(future)
+        for version in versions:
+            self._reply_waiters.setdefault(version, []).append(callback)
+        future.add_done_callback(lambda _: self._discard_reply(callback))
+        return future
+
+    def _discard_reply(self, callback: Callable):
+        for waiters in self._reply_waiters.values():
+            if callback in waiters:
+                waiters.remove(callback)
+
+    def _resolve_reply(self, characteristic: BleakGATTCharacteristic, reply_version: int, res: bytearray):
+        for callback in self._reply_waiters.pop(reply_version, []):
+            callback(characteristic, res)
+
+    async def _send_and_wait(self, message: list[int], versions: Tuple[int, ...], timeout: float):
+        """Send a packet and wait until the device answers with one of the reply versions.
+
+        If no reply arrives the full timeout is waited, like a fixed delay would.
+        """
+        future = self._expect_reply(versions)
+        start = time.monotonic()
+        try:
+            await self.sendPacket(message)
+            if await self._await_reply(future, timeout) is not None:
+                self._metrics.reply_rtt.record((time.monotonic() - start) * 1000)
+            else:
+                self._metrics.reply_timeouts += 1
+        finally:
+            future.cancel()
+
+    async def _await_reply(self, future: asyncio.Future, timeout: float) -> Optional[bytearray]:
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            LOGGER.debug(f"No reply within {timeout}s")
+            return None
+
+    @property
+    def connection_state(self) -> ConnectionState:
+        return self._state
+
+    @property
+    def state_history(self) -> list:
+        """Recent connection state transitions as (monotonic time, state)."""
+        return list(self._state_history)
+
+    def add_state_listener(self, listener: Callable[[ConnectionState, ConnectionState], None]) -> Callable:
+        """Call listener(old, new) on every connection state transition, returns a remove function."""
+        self._state_listeners.append(listener)
+        return lambda: self._state_listeners.remove(listener)
+
+    def _set_state(self, state: ConnectionState):
+        if state == self._state:
+            return
+        old, self._state = self._state, state
+        self._state_history.append((time.monotonic(), state))
+        LOGGER.debug(f"Connection state of {self._mac}: {old.value} -> {state.value}")
+        for listener in self._state_listeners:
+            listener(old, state)
+
+    def _in_backoff(self) -> bool:
+        """True while a failed device should not be retried yet."""
+        if self._state != ConnectionState.BACKOFF or self._backoff.remaining == 0:
+            return False
+        #The lamp advertised again since the failure, it is worth trying sooner. A lamp in range
+        #which keeps failing advertises all the time, so it still waits the initial delay.
+        entry = ADVERTISEMENTS.get(self._mac)
+        if entry is not None and entry.last_seen > self._backoff.failed_at:
+            self._backoff.shorten(entry.last_seen)
+        return self._backoff.remaining > 0
+
+    def disconnected_callback(self, client):
+        LOGGER.debug("Disconnected callback called!")
+        self._connections.release(self)
+        if self._state != ConnectionState.BACKOFF:
+            self._set_state(ConnectionState.DISCONNECTED)
+        if self._idle_disconnect:
+            #Dropped to save a connection slot, the light itself did not change
+            self._idle_disconnect = False
+            self._write_uuid = None
+            self._read_uuid = None
+            return
+        self._is_on = False
+        self._light_on = False
+        self._color_on = False
+        self._write_uuid = None
+        self._read_uuid = None
+        #Check back soon instead of waiting for a possibly long probe interval
+        PROBES.reset(self)
+        asyncio.create_task(self.trigger_entity_update())
+
+    def set_update_callback(self, trigger_update: Callable):
+        LOGGER.debug(f"Setting update callback to {trigger_update}")
+        self._trigger_update = trigger_update
+
+    async def _write(self, data: bytes, acknowledged: bool = True):
+        """Write a frame, unacknowledged frames are pipelined and only wait for room in the write window."""
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug(f"Sending in write: {protocol.hexdump(data)} to characteristic {self._write_uuid}, device is {self._device.is_connected}")
+        try:
+            if (not self._device.is_connected) or (self._write_uuid == None):
+                await self.connect()
+            if self._pipelined and self._write_without_response and not acknowledged:
+                await self._window.submit(lambda: self._write_unacknowledged(data))
+                #Counted when handed over, so per call packet counts do not depend on write completion
+                self._metrics.packets_sent += 1
+                self._metrics.packets_unacknowledged += 1
+                return
+            #Acknowledged writes must not overtake frames still in flight
+            await self._window.drain()
+            start = time.monotonic()
+            await self._device.write_gatt_char(self._write_uuid, data, response=True)
+            self._metrics.write.record((time.monotonic() - start) * 1000)
+            self._metrics.packets_sent += 1
+        except (BleakError) as error:
+            await self._write_failed(error)
+
+    async def _write_unacknowledged(self, data: bytes):
+        start = time.monotonic()
+        try:
+            await self._device.write_gatt_char(self._write_uuid, data, response=False)
+        except (BleakError) as error:
+            await self._write_failed(error)
+            return
+        self._metrics.write.record((time.monotonic() - start) * 1000)
+
+    async def _write_failed(self, error: BleakError):
+        self._metrics.write_failures += 1
+        track = traceback.format_exc()
+        LOGGER.debug(track)
+        LOGGER.warn(f"Error while trying to write to device: {error}")
+        await self.disconnect()
+
+    @property
+    def mac(self):
+        return self._mac
+
+    @property
+    def is_on(self):
+        return self._is_on
+
+    @property
+    def rgb_color(self):
+        return self._rgb_color
+
+    @property
+    def color_brightness(self):
+        return self._color_brightness
+
+    @property
+    def white_brightness(self):
+        return self._brightness
+
+    @property
+    def effect(self):
+        return self._effect
+
+    @property
+    def color_mode(self):
+        return self._mode
+
+    @property
+    def supported_effects(self):
+        return self._supported_effects
+
+    @property
+    def metrics(self) -> DeviceMetrics:
+        return self._metrics
+
+    @property
+    def last_transaction(self) -> Optional[TransactionReport]:
+        return self._last_transaction
+
+    @property
+    def command_stats(self) -> dict:
+        """Logical commands merged or cancelled by the CommandExecutor, packets sent and commands pending."""
+        return {
+            "merged": self._metrics.commands_merged,
+            "cancelled": self._metrics.commands_cancelled,
+            "sent": self._metrics.packets_sent,
+            "pending": self._executor.depth,
+        }
+
+    @property
+    def command_queue_depth(self) -> int:
+        """Logical commands running or waiting, see CommandExecutor."""
+        return self._executor.depth
+
+    def find_effect_position(self, effect) -> int:
+        try:
+            return self._supported_effects.index(effect)
+        except ValueError:
+            #return Off if not found
+            return 0
+
+    def makeChecksum(self, b: int, bArr: list[int]) -> int:
+        return protocol.checksum(b, bArr)
+
+    async def sendPacket(self, message: list[int]):
+        """Write a packet right away, connecting first if needed. Commands are merged by the CommandExecutor."""
+        if not self._device.is_connected and not await self.connect():
+            raise DeviceUnavailable(f"Device {self._mac} is unavailable, next connect attempt in {self._backoff.remaining:.0f}s")
+        self._connections.touch(self)
+        frame = protocol.encode(message)
+        if self._recorder is not None:
+            self._recorder.record(self._device_id, OUTBOUND, frame)
+        await self._write(frame, acknowledged=message[0] in ACKNOWLEDGED_OPCODES)
+
+    def _cancel_transition(self):
+        """A new command replaces a running transition, unless the transition sent it."""
+        if (self._transition is not None and not self._transition.done() and self._transition is not asyncio.current_task()
+                and self._transition is not _COMMAND.get()[1]):
+            LOGGER.debug("Cancelling running transition")
+            self._transition.cancel()
+
+    def start_transition(self, duration: float, white: bool = False, rgb_color: Optional[Tuple[int, int, int]] = None,
+                         brightness: Optional[int] = None, off: bool = False) -> asyncio.Task:
+        """Fade to the given color/brightness (or off) in the background, see run_transition."""
+        self._cancel_transition()
+
+        async def transition():
+            self._last_transition_stats = await run_transition(self, duration, white, rgb_color, brightness, off)
+        self._transition = asyncio.create_task(transition())
+        return self._transition
+
+    @property
+    def last_transition_stats(self):
+        return self._last_transition_stats
+
+    @property
+    def streaming(self) -> bool:
+        return self._streaming
+
+    async def start_streaming(self):
+        """Turn the mood light on without effect and pause status polling for stream_color."""
+        self._cancel_transition()
+        self._cancel_verify()
+        await self.apply_state(color_brightness=self._color_brightness or 255, effect="Off")
+        await self._window.drain()
+        self._streaming = True
+
+    async def stream_color(self, rgb: Tuple[int, int, int]):
+        """Write a streamed color right away, bypassing the CommandExecutor and status verification."""
+        await self.sendPacket([0x32, *rgb])
+        self._rgb_color = tuple(rgb)
+
+    async def stop_streaming(self):
+        """Resume polling, the last streamed color is verified and published like a command."""
+        if not self._streaming:
+            return
+        self._streaming = False
+        await self._window.drain()
+        await self._command_done(_color_on=True)
+
+    @serialized()
+    async def set_color(self, rgb: Tuple[int, int, int]):
+        self._cancel_transition()
+        r, g, b = rgb
+        LOGGER.debug(f"Setting to color: %s, %s, %s", r, g, b)
+        self._mode = COLOR_MODE_RGB
+        self._rgb_color = (r,g,b)
+        if not self._color_on:
+            await self.turn_on()
+        await self._send_last([0x32,r,g,b], 0.1)
+        await self._command_done(_color_on=True)
+
+    @serialized()
+    async def set_color_brightness(self, brightness: int):
+        self._cancel_transition()
+        LOGGER.debug(f"Setting to brightness {brightness}")
+        self._mode = COLOR_MODE_RGB
+        if not self._color_on:
+            await self.turn_on()
+        await self._send_last([0x31,0x02,int(brightness/255*100)], 0.1)
+        await self._command_done(_color_on=True, _color_brightness=brightness)
+
+    @serialized()
+    async def set_white(self, intensity: int):
+        self._cancel_transition()
+        LOGGER.debug(f"Setting white to intensity: %s", intensity)
+        #self._brightness = intensity
+        self._mode = COLOR_MODE_WHITE
+        if not self._light_on:
+            await self.turn_on()
+        await self._send_last([0x31,0x01,int(intensity/255*100)], 0.2)
+        await self._command_done(_light_on=True, _brightness=intensity)
+
+    @serialized()
+    async def set_effect(self, effect: str):
+        self._cancel_transition()
+        LOGGER.debug(f"Setting effect {effect}")
+        self._mode = COLOR_MODE_RGB
+        if not self._color_on:
+            await self.turn_on()
+        await self.sendPacket([0x34,self.find_effect_position(effect)])
+        await self._command_done(_color_on=True, _effect=self._supported_effects[self.find_effect_position(effect)])
+
+    @serialized()
+    async def turn_on(self):
+        self._cancel_transition()
+        LOGGER.debug("Turning on")
+        if not self._device.is_connected:
+            await self.connect()
+        #WHITE mode
+        if self._mode == COLOR_MODE_WHITE:
+            await self._send_and_wait([0x37,0x01], REPLY_ANY, 0.2)
+        #COLOR mode
+        else:
+            await self._send_and_wait([0x37,0x02], REPLY_ANY, 0.2)
+            LOGGER.debug(f"Current color state: {self._color_on}, {self._rgb_color}, {self._color_brightness}, {self._effect}")
+            #Lamp wants to turn on on rainbow mode when enabling mood light, so send last status
+            if not self._color_on:
+                LOGGER.debug(f"Restoring last known color state")
+                self._color_on = True
+                #Each step waits for the status reply of the previous one, unknown values are left to the lamp
+                await self.set_effect(self._effect)
+                await self.set_color(self._rgb_color)
+                if self._color_brightness is not None:
+                    await self.set_color_brightness(self._color_brightness)
+        if self._mode == COLOR_MODE_WHITE:
+            await self._command_done(_light_on=True)
+        else:
+            await self._command_done(_color_on=True)
+
+    @serialized(PRIORITY_POWER_OFF, preempt=True)
+    async def turn_off(self):
+        self._cancel_transition()
+        LOGGER.debug("Turning off")
+        #turn off white
+        await self.sendPacket([0x35,0x01])
+        #turn off color
+        await self._send_last([0x35,0x02], 0.1)
+        await self._command_done(_light_on=False, _color_on=False)
+
+    async def _send_last(self, message: list[int], timeout: float):
+        """Send the last packet of a command, waiting for the lamp only if its status is polled right after."""
+        if self._optimistic:
+            await self.sendPacket(message)
+        else:
+            await self._send_and_wait(message, REPLY_ANY, timeout)
+
+    async def _command_done(self, **expected):
+        """Finish a command: poll the status, or apply the expected state and verify it later."""
+        if not self._optimistic:
+            await self.triggerStatus()
+            return
+        for name, value in expected.items():
+            setattr(self, name, value)
+        self._is_on = bool(self._light_on or self._color_on)
+        self._generation += 1
+        if self._verify_handle:
+            self._verify_handle.cancel()
+        self._verify_handle = asyncio.get_running_loop().call_later(self._verify_delay, self._start_verify)
+        await self.trigger_entity_update()
+
+    def _start_verify(self):
+        self._verify_handle = None
+        self._verify_task = asyncio.create_task(self._verify())
+
+    def _cancel_verify(self):
+        """Drop a pending verification, e.g. when disconnecting, so it does not reconnect the lamp."""
+        if self._verify_handle:
+            self._verify_handle.cancel()
+            self._verify_handle = None
+        if self._verify_task and not self._verify_task.done() and self._verify_task is not asyncio.current_task():
+            self._verify_task.cancel()
+        self._verify_task = None
+
+    def _snapshot(self) -> tuple:
+        return (bool(self._light_on), bool(self._color_on), tuple(self._rgb_color or ()),
+                self._known_percent(self._color_brightness), self._known_percent(self._brightness), self._effect)
+
+    async def _verify(self):
+        """Check the optimistic state against the lamp, the status replies overwrite it if it differs."""
+        if not self._device.is_connected:
+            #Only a connected lamp is checked, polling would reconnect it
+            return
+        generation = self._generation
+        expected = self._snapshot()
+        try:
+            await self.triggerStatus()
+        except BleakError as error:
+            LOGGER.debug(f"Could not verify state: {error}")
+            return
+        if generation != self._generation:
+            #A newer command scheduled its own verification
+            return
+        reported = self._snapshot()
+        if reported != expected:
+            self._metrics.optimistic_mismatches += 1
+            LOGGER.info(f"Lamp {self._mac} reported {reported} instead of expected {expected}, resynced")
+            await self.trigger_entity_update()
+
+    def _known_percent(self, value: Optional[int]) -> Optional[int]:
+        return round(value*100/255) if value is not None else None
+
+    def _wanted_channels(self, white_brightness, rgb_color, color_brightness, effect) -> Tuple[bool, bool]:
+        """Return which of the white and mood light channels a requested state turns on."""
+        wants_color = rgb_color is not None or color_brightness is not None or effect is not None
+        wants_white = white_brightness is not None
+        if not wants_color and not wants_white:
+            #Plain turn on, restore the last mode
+            wants_white = self._mode == COLOR_MODE_WHITE
+            wants_color = not wants_white
+        return wants_white, wants_color
+
+    def plan_state(self, on: bool = True, white_brightness: Optional[int] = None, rgb_color: Optional[Tuple[int, int, int]] = None,
+                   color_brightness: Optional[int] = None, effect: Optional[str] = None) -> list[list[int]]:
+        """Return the smallest ordered packet sequence to get from the known to the requested state."""
+        if not on:
+            #Unknown (None) channel state is treated as on
+            return [[0x35, channel] for channel, channel_on in ((0x01, self._light_on), (0x02, self._color_on)) if channel_on is not False]
+
+        wants_white, wants_color = self._wanted_channels(white_brightness, rgb_color, color_brightness, effect)
+        packets = []
+        if wants_white:
+            if not self._light_on:
+                packets.append([0x37, 0x01])
+            if white_brightness is not None and to_percent(white_brightness) != self._known_percent(self._brightness):
+                packets.append([0x31, 0x01, to_percent(white_brightness)])
+
+        if wants_color:
+            powering_on = not self._color_on
+            if powering_on:
+                packets.append([0x37, 0x02])
+                #Lamp turns on in rainbow mode when enabling mood light, so everything has to be restored
+                effect = effect if effect is not None else self._effect
+                rgb_color = rgb_color if rgb_color is not None else self._rgb_color
+                color_brightness = color_brightness if color_brightness is not None else self._color_brightness
+            if effect is not None and (powering_on or effect != self._effect):
+                packets.append([0x34, self.find_effect_position(effect)])
+            if rgb_color is not None and (powering_on or tuple(rgb_color) != tuple(self._rgb_color)):
+                packets.append([0x32, *rgb_color])
+            if color_brightness is not None and (powering_on or to_percent(color_brightness) != self._known_percent(self._color_brightness)):
+                packets.append([0x31, 0x02, to_percent(color_brightness)])
+        return packets
+
+    @serialized()
+    async def apply_state(self, on: bool = True, white_brightness: Optional[int] = None, rgb_color: Optional[Tuple[int, int, int]] = None,
+                          color_brightness: Optional[int] = None, effect: Optional[str] = None) -> TransactionReport:
+        """Move the lamp to the requested state with the fewest packets and a single status verification.
+
+        In optimistic mode the verification is deferred and batched with other commands.
+        """
+        self._cancel_transition()
+        if not self._device.is_connected:
+            await self.connect()
+        report = TransactionReport(commands=self.plan_state(on, white_brightness, rgb_color, color_brightness, effect))
+        LOGGER.debug(f"Planned transaction: {report.commands}")
+        expected = {"_light_on": False, "_color_on": False}
+        if on:
+            expected = {}
+            wants_white, wants_color = self._wanted_channels(white_brightness, rgb_color, color_brightness, effect)
+            if wants_white:
+                expected["_light_on"] = True
+                if white_brightness is not None:
+                    expected["_brightness"] = white_brightness
+            if wants_color:
+                expected["_color_on"] = True
+                if color_brightness is not None:
+                    expected["_color_brightness"] = color_brightness
+                if effect is not None:
+                    expected["_effect"] = self._supported_effects[self.find_effect_position(effect)]
+            if white_brightness is not None:
+                self._mode = COLOR_MODE_WHITE
+            if rgb_color is not None or color_brightness is not None or effect is not None:
+                self._mode = COLOR_MODE_RGB
+            if rgb_color is not None:
+                self._rgb_color = tuple(rgb_color)
+        for message in report.commands:
+            if message[0] == 0x37:
+                #Let the lamp power up before sending the values
+                await self._send_and_wait(message, REPLY_ANY, 0.2)
+                if message[1] == 0x02:
+                    self._color_on = True
+            else:
+                await self.sendPacket(message)
+        await self._command_done(**expected)
+        #Optimistic transactions are verified later in a batched poll
+        report.status_packets = 0 if self._optimistic else 2
+        LOGGER.debug(f"Transaction sent {report.command_packets} command and {report.status_packets} status packets")
+        self._last_transaction = report
+        return report
+
+    def diagnostics(self) -> dict:
+        """Performance and connection details for the diagnostics download."""
+        return {
+            "mac": self._mac,
+            "ready": self.is_ready,
+            "connection_state": self._state.value,
+            "state_history": [(round(at, 3), state.value) for at, state in self._state_history],
+            "adapter": self._connections.adapter_of(self),
+            "adapter_migrations": self.migrations,
+            "backoff_failures": self._backoff.failures,
+            "backoff_remaining": round(self._backoff.remaining, 1),
+            "streaming": self._streaming,
+            "trace": self._recorder.stats() if self._recorder else None,
+            "command_queue": self.command_stats,
+            "commands": self._executor.stats(),
+            "write_window": self._window.stats() if self._pipelined and self._write_without_response else None,
+            "last_transaction_packets": self._last_transaction.total_packets if self._last_transaction else None,
+            "metrics": self._metrics.as_dict(),
+        }
+
+    async def triggerStatus(self, force: bool = False):
+        """Request the status of both channels, force also polls while streaming (used while connecting)."""
+        if self._streaming and not force:
+            #The stream owns the link, polling would only delay frames
+            return
+        #Trigger notification with current values, an off device answers both with version 255
+        await self._send_and_wait([0x30,0x01], (1, 255), 0.2)
+        await self._send_and_wait([0x30,0x02], (2, 255), 0.2)
+        LOGGER.info(f"Triggered update")
+
+    def _published_state(self) -> tuple:
+        return (self.is_ready, self._is_on, self._mode, self._rgb_color, self._brightness, self._color_brightness, self._effect)
+
+    async def trigger_entity_update(self):
+        """Publish the state once per loop iteration, and only if it changed since the last publish."""
+        if not self._trigger_update:
+            LOGGER.warn(f"No async update function provided: {self._trigger_update}")
+            return
+        if self._publish_scheduled:
+            self._metrics.entity_writes_merged += 1
+            return
+        self._publish_scheduled = True
+        asyncio.get_running_loop().call_soon(self._publish)
+
+    def _publish(self):
+        self._publish_scheduled = False
+        state = self._published_state()
+        if state == self._last_published:
+            self._metrics.entity_writes_suppressed += 1
+            return
+        self._last_published = state
+        self._metrics.entity_writes += 1
+        LOGGER.debug(f"Triggering async update")
+        self._trigger_update()
+
+    #We receive status version 1 then version 2.
+    # So changes to the light status shall only be done in version 2 handler
+    async def notification_handler(self, characteristic: BleakGATTCharacteristic, res: bytearray):
+        """Notification handler which applies the reported status."""
+        if self._recorder is not None:
+            self._recorder.record(self._device_id, INBOUND, res)
+        debug = LOGGER.isEnabledFor(logging.DEBUG)
+        if debug:
+            LOGGER.debug(f"Received notification: {protocol.hexdump(res)}")
+        status = protocol.parse_notification(res)
+        if status is None:
+            return
+        self._last_notification = time.monotonic()
+        reply_version = status.version
+        #Short version with only _brightness
+        if reply_version == protocol.REPLY_WHITE:
+            self._light_on = status.on
+            if status.on:
+                self._brightness = int(status.brightness*255/100) if status.brightness > 0 else None
+                self._mode = COLOR_MODE_WHITE
+            if debug:
+                LOGGER.debug(f"Short version, on: {self._is_on}, brightness: {self._brightness}")
+        #Long version with color information
+        elif reply_version == protocol.REPLY_MOOD:
+                self._color_on = status.on
+                if status.on:
+                    self._mode = COLOR_MODE_RGB
+                    #effect will be turned off if light off, update only if light on
+                    if status.effect < len(self._supported_effects):
+                        self._effect = self._supported_effects[status.effect]
+                self._color_brightness = int(status.brightness*255/100) if status.brightness > 0 else None
+                self._rgb_color = status.rgb
+                self._is_on = self._light_on or self._color_on
+                if debug:
+                    LOGGER.debug(f"Long version, on: {self._is_on}, brightness: {self._color_brightness}, rgb color: {self._rgb_color}, effect: {self._effect}")
+                    LOGGER.debug(f"light_on {self._light_on}, color_on {self._color_on}")
+                await self.trigger_entity_update()
+        #Device turned off
+        elif reply_version == protocol.REPLY_OFF:
+                self._is_on = False
+                self._light_on = False
+                self._color_on = False
+                LOGGER.debug(f"Device off")
+                await self.trigger_entity_update()
+        #Device is going to shutdown
+        elif reply_version == protocol.REPLY_SHUTDOWN:
+            LOGGER.debug(f"Device is going to shut down")
+            await self.disconnect()
+            return
+        else:
+            LOGGER.debug(f"Received unknown notification")
+            return
+        self._resolve_reply(characteristic, reply_version, res)
+
+    def state_snapshot(self) -> dict:
+        """Last known light state, persisted by the entity across restarts."""
+        return {
+            "is_on": self._is_on,
+            "light_on": self._light_on,
+            "color_on": self._color_on,
+            "mode": self._mode,
+            "rgb_color": list(self._rgb_color) if self._rgb_color else None,
+            "brightness": self._brightness,
+            "color_brightness": self._color_brightness,
+            "effect": self._effect,
+        }
+
+    def restore_state(self, state: dict):
+        """Show a persisted state until the lamp reports its own, does not connect."""
+        if self._device.is_connected:
+            return
+        self._is_on = bool(state.get("is_on"))
+        self._light_on = state.get("light_on")
+        self._color_on = state.get("color_on")
+        self._mode = state.get("mode")
+        self._rgb_color = tuple(state["rgb_color"]) if state.get("rgb_color") else self._rgb_color
+        self._brightness = state.get("brightness")
+        self._color_brightness = state.get("color_brightness")
+        self._effect = state.get("effect")
+        LOGGER.debug(f"Restored state of {self._mac}: {state}")
+
+    def connect_later(self, delay: float):
+        """Connect in the background after delay seconds, a command sent before connects right away."""
+        if self._connect_handle:
+            self._connect_handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._connect_handle = loop.call_later(delay, lambda: loop.create_task(self._background_connect()))
+
+    async def _background_connect(self):
+        self._connect_handle = None
+        if not self._device.is_connected:
+            await self.connect()
+
+    @property
+    def is_ready(self) -> bool:
+        """True once the device was found, commands fail with DeviceUnavailable before."""
+        return self._ready.is_set()
+
+    async def wait_ready(self):
+        await self._ready.wait()
+
+    def set_device(self, device: BLEDevice):
+        """Use a (newly) found device, the client is rebuilt unless it is connected."""
+        self._ble_device = device
+        if not self._device.is_connected:
+            self._device = self._client_class(device, disconnected_callback=self.disconnected_callback)
+        if not self._ready.is_set():
+            self._ready.set()
+            LOGGER.info(f"Found device {self._mac}")
+            asyncio.create_task(self.trigger_entity_update())
+
+    def start_resolving(self):
+        """Look for the device in the background until it advertises, see resolve_device."""
+        if not self.is_ready and (self._resolver is None or self._resolver.done()):
+            self._resolver = asyncio.create_task(self.resolve_device())
+
+    async def resolve_device(self):
+        """Wait for an advertisement of the device, retrying with growing intervals like a not ready config entry."""
+        backoff = Backoff(DISCOVERY_TIMEOUT, BACKOFF_MAX)
+        while not self.is_ready:
+            timeout = backoff.fail()
+            try:
+                device = await ADVERTISEMENTS.async_get_device(self._mac, timeout)
+            except BleakError as error:
+                LOGGER.debug(f"Scanning for {self._mac} failed: {error}")
+                await asyncio.sleep(timeout)
+                continue
+            if device is not None:
+                self.set_device(device)
+                self.connect_later(0)
+                return
+            log = LOGGER.warning if backoff.failures == 1 else LOGGER.debug
+            log(f"Device {self._mac} not found yet, still looking for it")
+
+    @property
+    def last_notification(self) -> float:
+        """Monotonic time of the last notification from the lamp."""
+        return self._last_notification
+
+    async def probe(self) -> bool:
+        """Status check for the probe scheduler, True if the lamp answered or there is nothing to check."""
+        if self._streaming or (self._released and not self._device.is_connected):
+            #Streams own the link, released lamps keep their known state until the next command
+            return True
+        await self.migrate_if_degraded()
+        if not self._device.is_connected:
+            #Connecting requests the status
+            return await self.connect()
+        timeouts = self._metrics.reply_timeouts
+        await self.triggerStatus()
+        return self._metrics.reply_timeouts == timeouts
+
+    async def connect(self) -> bool:
+        if self._state == ConnectionState.READY and self._device.is_connected:
+            return True
+        if not self.is_ready:
+            LOGGER.debug(f"Not connecting, device {self._mac} was not found yet")
+            return False
+        if self._in_backoff():
+            LOGGER.debug(f"Not connecting, device in backoff for {self._backoff.remaining:.1f}s")
+            return False
+        #Callers arriving during a connect attempt share it
+        if self._connecting is None or self._connecting.done():
+            self._connecting = asyncio.create_task(self._connect())
+        return await asyncio.shield(self._connecting)
+
+    def _choose_adapter(self) -> str:
+        """Adapter (or proxy) to connect through, the client is switched to that adapter's view of the device."""
+        if ADVERTISEMENTS.hass_attached:
+            #Home Assistant's client wrapper picks the adapter by address itself, only count the slot
+            self._adapter_rssi = None
+            return adapter_of(self._ble_device)
+        sources = ADVERTISEMENTS.sources(self._mac)
+        adapter = self._connections.choose_adapter(self, {name: entry.rssi for name, entry in sources.items()})
+        if adapter is None:
+            self._adapter_rssi = None
+            return adapter_of(self._ble_device)
+        self._adapter_rssi = sources[adapter].rssi
+        if sources[adapter].device is not self._ble_device:
+            self.set_device(sources[adapter].device)
+        return adapter
+
+    async def migrate_if_degraded(self) -> bool:
+        """Reconnect through another adapter if it scores clearly better than the current one.
+
+        Scores change with signal strength, slot usage, connect times and failures of the adapters.
+        Home Assistant chooses the adapter of its connections itself, there is nothing to balance then.
+        """
+        current = self._connections.adapter_of(self)
+        if current is None or not self._device.is_connected or self._streaming or ADVERTISEMENTS.hass_attached:
+            return False
+        rssi = {name: entry.rssi for name, entry in ADVERTISEMENTS.sources(self._mac).items()}
+        #Connected lamps may stop advertising, keep the signal seen when connecting
+        rssi.setdefault(current, self._adapter_rssi)
+        scores = self._connections.scores(self, rssi)
+        best = max(scores, key=scores.get)
+        if best == current or scores[best] - scores[current] < MIGRATE_MARGIN:
+            return False
+        LOGGER.info(f"Moving {self._mac} from adapter {current} ({scores[current]:.0f}) to {best} ({scores[best]:.0f})")
+        self.migrations += 1
+        await self.release_connection()
+        #The lamp is moved, not released, so a failed reconnect is retried by the next probe
+        self._released = False
+        return await self.connect()
+
+    async def _connect(self) -> bool:
+        LOGGER.debug(f"Going to connect to device")
+        start = time.monotonic()
+        adapter = None
+        try:
+            if not self._device.is_connected:
+                self._set_state(ConnectionState.CONNECTING)
+                adapter = self._choose_adapter()
+                #Wait for a free connection slot on the adapter
+                await self._connections.acquire(self, adapter)
+                #Services are resolved once connect returns
+                connect_start = time.monotonic()
+                try:
+                    await self._device.connect(timeout=20)
+                except Exception:
+                    self._connections.record_connect(adapter, time.monotonic() - connect_start, False)
+                    raise
+                self._connections.record_connect(adapter, time.monotonic() - connect_start, True)
+
+                self._set_state(ConnectionState.DISCOVERING_SERVICES)
+
+                for char in self._device.services.characteristics.values():
+                    if char.uuid in WRITE_CHARACTERISTIC_UUIDS:
+                        self._write_uuid = char.uuid
+                        self._write_without_response = "write-without-response" in char.properties
+                    if char.uuid in READ_CHARACTERISTIC_UUIDS:
+                        self._read_uuid = char.uuid
+
+                if not self._read_uuid or not self._write_uuid:
+                    LOGGER.error("No supported read/write UUIDs found")
+                    await self._enter_backoff()
+                    return False
+
+                LOGGER.info(f"Read UUID: {self._read_uuid}, Write UUID: {self._write_uuid}")
+
+            LOGGER.info(f"Starting notifications")
+
+            await self._device.start_notify(self._read_uuid, self.notification_handler)
+            self._set_state(ConnectionState.SUBSCRIBED)
+
+            #Waits for the status replies
+            await self.triggerStatus(force=True)
+        except (Exception) as error:
+            track = traceback.format_exc()
+            LOGGER.debug(track)
+            LOGGER.error(f"Error connecting: {error}")
+            await self._enter_backoff()
+            return False
+        self._backoff.reset()
+        self._released = False
+        self._metrics.connects += 1
+        self._metrics.connect.record((time.monotonic() - start) * 1000)
+        self._set_state(ConnectionState.READY)
+        return True
+
+    async def _enter_backoff(self):
+        self._metrics.connect_failures += 1
+        delay = self._backoff.fail()
+        LOGGER.info(f"Connecting to {self._mac} failed {self._backoff.failures} times, retrying in {delay:.1f}s")
+        self._set_state(ConnectionState.BACKOFF)
+        if self._device.is_connected:
+            await self._device.disconnect()
+        self._connections.release(self)
+
+    async def update(self):
+        if not self.is_ready:
+            #Still looking for the device in the background, see start_resolving
+            LOGGER.debug(f"Not updating, device {self._mac} was not found yet")
+            return
+        try:
+            if not self._device.is_connected:
+                if not await self.connect():
+                    LOGGER.info("Was not able to connect to device for updates")
+                    await self.disconnect()
+                    return
+                #Connecting already requested the status
+                return
+
+            LOGGER.info(f"Triggering update")
+
+            await self.triggerStatus()
+            #await asyncio.sleep(0.1)
+
+        except (Exception) as error:
+            track = traceback.format_exc()
+            LOGGER.debug(track)
+            LOGGER.error(f"Error getting status: {error}")
+            await self.disconnect()
+
+    async def release_connection(self):
+        """Disconnect to free the connection slot without changing the known light state."""
+        self._cancel_verify()
+        if self._device.is_connected:
+            self._idle_disconnect = True
+            self._released = True
+            await self._device.disconnect()
+        self._connections.release(self)
+
+    async def disconnect(self):
+        LOGGER.debug("Disconnecting")
+        self._cancel_verify()
+        if self._connect_handle:
+            self._connect_handle.cancel()
+            self._connect_handle = None
+        if self._device.is_connected:
+            await self._device.disconnect()
+        self._connections.release(self)
+        if self._state != ConnectionState.BACKOFF:
+            self._set_state(ConnectionState.DISCONNECTED)
+        self._is_on = False
+        self._light_on = False
+        self._color_on = False
+        await self.trigger_entity_update()
+
+    async def close(self):
+        """Disconnect for good, e.g. on unload, and stop looking for a device not found yet."""
+        if self._resolver and not self._resolver.done() and self._resolver is not asyncio.current_task():
+            self._resolver.cancel()
+        await self.disconnect()
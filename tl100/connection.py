@@ -0,0 +1,312 @@
+from typing import Any, Awaitable, Callable, Optional
+from collections import deque
+from enum import Enum
+import asyncio
+import random
+import time
+
+from bleak import BLEDevice, BleakError
+
+from .const import (LOGGER, CONNECTION_SLOTS, IDLE_DISCONNECT_TIMEOUT, HOT_WINDOW, BACKOFF_INITIAL, BACKOFF_MAX, WRITE_WINDOW,
+                    SLOT_WEIGHT, CONNECT_TIME_WEIGHT, FAILURE_WEIGHT)
+
+class ConnectionState(Enum):
+    DISCONNECTED = "disconnected"
+    CONNECTING = "connecting"
+    DISCOVERING_SERVICES = "discovering_services"
+    SUBSCRIBED = "subscribed"
+    READY = "ready"
+    BACKOFF = "backoff"
+
+class DeviceUnavailable(BleakError):
+    """Raised for commands to a device which is waiting before the next connect attempt."""
+
+class Backoff:
+    """Exponential backoff with jitter between failed connect attempts."""
+    def __init__(self, initial: float = BACKOFF_INITIAL, maximum: float = BACKOFF_MAX) -> None:
+        self.initial = initial
+        self.maximum = maximum
+        self.failures = 0
+        self.failed_at = 0.0
+        self.retry_at = 0.0
+        self.shortened = False
+
+    @property
+    def remaining(self) -> float:
+        return max(0.0, self.retry_at - time.monotonic())
+
+    def fail(self) -> float:
+        """Record a failed attempt, returns the delay before the next one."""
+        delay = min(self.maximum, self.initial * 2 ** self.failures)
+        #Equal jitter, so lamps failing together do not retry together
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        self.failures += 1
+        self.failed_at = time.monotonic()
+        self.retry_at = self.failed_at + delay
+        self.shortened = False
+        return delay
+
+    def shorten(self, seen_at: float):
+        """Retry at most the initial delay after seen_at, once per failure."""
+        if self.shortened:
+            return
+        self.shortened = True
+        self.retry_at = min(self.retry_at, seen_at + self.initial)
+
+    def reset(self):
+        self.failures = 0
+        self.retry_at = 0.0
+
+class WriteWindow:
+    """Bounds the unacknowledged writes in flight on one connection.
+
+    submit returns as soon as the write started, or waits while the window is full.
+    The window grows by one per write completing in time and halves when a write takes
+    much longer than the fastest one seen, which means the adapter buffers are full.
+    """
+    def __init__(self, limit: int = WRITE_WINDOW) -> None:
+        self.limit = limit
+        self.size = limit
+        self.max_in_flight = 0
+        self.shrinks = 0
+        self.waits = 0
+        self._fastest = None
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def submit(self, write: Callable[[], Awaitable[None]]):
+        while len(self._tasks) >= self.size:
+            self.waits += 1
+            await asyncio.wait(self._tasks, return_when=asyncio.FIRST_COMPLETED)
+        task = asyncio.create_task(self._run(write))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.max_in_flight = max(self.max_in_flight, len(self._tasks))
+
+    async def _run(self, write: Callable[[], Awaitable[None]]):
+        start = time.monotonic()
+        try:
+            await write()
+        except Exception as error:
+            #Nobody awaits the write anymore, so it is only logged
+            LOGGER.warning(f"Pipelined write failed: {error}")
+            return
+        self._adapt(time.monotonic() - start)
+
+    def _adapt(self, elapsed: float):
+        if self._fastest is None or elapsed < self._fastest:
+            self._fastest = elapsed
+        if elapsed > 3 * self._fastest + 0.001:
+            if self.size > 1:
+                self.size //= 2
+                self.shrinks += 1
+        elif self.size < self.limit:
+            self.size += 1
+
+    async def drain(self):
+        """Wait for all writes in flight, keeps acknowledged writes in order behind them."""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks))
+
+    def stats(self) -> dict:
+        return {"size": self.size, "limit": self.limit, "in_flight": len(self._tasks),
+                "max_in_flight": self.max_in_flight, "shrinks": self.shrinks, "waits": self.waits}
+
+def adapter_of(device: Optional[BLEDevice]) -> str:
+    """Return the name of the adapter (or proxy) a device was seen by."""
+    details = getattr(device, "details", None)
+    if isinstance(details, dict):
+        #Home Assistant bluetooth reports the source, BlueZ the D-Bus path /org/bluez/hci0/dev_..
+        if details.get("source"):
+            return str(details["source"])
+        path = details.get("path")
+        if path and path.count("/") >= 3:
+            return path.split("/")[3]
+    return "default"
+
+class Lease:
+    """A connection slot held by a device."""
+    __slots__ = ("instance", "adapter", "acquired", "last_used", "evicting")
+
+    def __init__(self, instance: Any, adapter: "AdapterSlots") -> None:
+        self.instance = instance
+        self.adapter = adapter
+        self.acquired = time.monotonic()
+        self.last_used = self.acquired
+        self.evicting = False
+
+class AdapterSlots:
+    """Connection slots of one adapter, handed out in request order."""
+    def __init__(self, name: str, limit: int) -> None:
+        self.name = name
+        self.limit = limit
+        self.leases: dict[Any, Lease] = {}
+        self.waiters: deque = deque()
+        self.grants = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        #Moving averages of connect attempts through this adapter
+        self.connect_time = None
+        self.failure_rate = 0.0
+
+    @property
+    def free(self) -> int:
+        return self.limit - len(self.leases)
+
+    def record_connect(self, seconds: float, success: bool):
+        if success:
+            self.connect_time = seconds if self.connect_time is None else 0.8 * self.connect_time + 0.2 * seconds
+        self.failure_rate = 0.8 * self.failure_rate + (0.0 if success else 0.2)
+
+    def score(self, rssi: Optional[int], holder: Any = None) -> float:
+        """Higher is better, holder's own slot does not count as used."""
+        used = len(self.leases) - (1 if holder in self.leases else 0) + len(self.waiters)
+        return ((rssi if rssi is not None else -100) - SLOT_WEIGHT * min(1.0, used / self.limit)
+                - CONNECT_TIME_WEIGHT * (self.connect_time or 0.0) - FAILURE_WEIGHT * self.failure_rate)
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_use": len(self.leases),
+            "waiting": len(self.waiters),
+            "grants": self.grants,
+            "avg_wait": self.total_wait / self.grants if self.grants else 0.0,
+            "max_wait": self.max_wait,
+            "connect_time": round(self.connect_time, 3) if self.connect_time is not None else None,
+            "failure_rate": round(self.failure_rate, 2),
+        }
+
+class ConnectionManager:
+    """Caps concurrent connections per adapter and disconnects idle devices.
+
+    Devices call acquire before connecting and release once disconnected. When all
+    slots of an adapter are taken, requests queue in order and the least recently
+    used device that is not hot gives its slot up.
+    """
+    def __init__(self, slots: int = CONNECTION_SLOTS, idle_timeout: float = IDLE_DISCONNECT_TIMEOUT) -> None:
+        self.slots = slots
+        self.idle_timeout = idle_timeout
+        self._adapters: dict[str, AdapterSlots] = {}
+        self._leases: dict[Any, Lease] = {}
+        self._reaper = None
+
+    def _adapter(self, name: str) -> AdapterSlots:
+        if name not in self._adapters:
+            self._adapters[name] = AdapterSlots(name, self.slots)
+        return self._adapters[name]
+
+    def stats(self) -> dict:
+        """Slot usage and wait times per adapter."""
+        return {name: adapter.stats() for name, adapter in self._adapters.items()}
+
+    def holds(self, instance: Any) -> bool:
+        return instance in self._leases
+
+    def adapter_of(self, instance: Any) -> Optional[str]:
+        """Name of the adapter the instance holds a slot on."""
+        lease = self._leases.get(instance)
+        return lease.adapter.name if lease else None
+
+    def scores(self, instance: Any, rssi_by_adapter: dict[str, Optional[int]]) -> dict[str, float]:
+        return {name: self._adapter(name).score(rssi, instance) for name, rssi in rssi_by_adapter.items()}
+
+    def choose_adapter(self, instance: Any, rssi_by_adapter: dict[str, Optional[int]]) -> Optional[str]:
+        """Pick the adapter to connect through by signal, free slots, connect time and failures."""
+        scores = self.scores(instance, rssi_by_adapter)
+        return max(scores, key=scores.get) if scores else None
+
+    def record_connect(self, adapter_name: str, seconds: float, success: bool):
+        self._adapter(adapter_name).record_connect(seconds, success)
+
+    def touch(self, instance: Any):
+        """Mark a device as used, keeps it from being disconnected as idle."""
+        lease = self._leases.get(instance)
+        if lease:
+            lease.last_used = time.monotonic()
+
+    async def acquire(self, instance: Any, adapter_name: str = "default"):
+        """Wait for a connection slot on the adapter."""
+        if instance in self._leases:
+            self.touch(instance)
+            return
+        adapter = self._adapter(adapter_name)
+        start = time.monotonic()
+        if adapter.free > 0 and not adapter.waiters:
+            self._grant(adapter, instance)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            adapter.waiters.append((instance, future))
+            LOGGER.debug(f"Waiting for a connection slot on {adapter.name}, {len(adapter.waiters)} waiting")
+            try:
+                while True:
+                    self._evict_idle(adapter)
+                    try:
+                        await asyncio.wait_for(asyncio.shield(future), HOT_WINDOW)
+                        break
+                    except asyncio.TimeoutError:
+                        continue
+            except asyncio.CancelledError:
+                if (instance, future) in adapter.waiters:
+                    adapter.waiters.remove((instance, future))
+                elif future.done():
+                    #Slot was handed over while being cancelled, pass it on
+                    self.release(instance)
+                raise
+        wait = time.monotonic() - start
+        adapter.grants += 1
+        adapter.total_wait += wait
+        adapter.max_wait = max(adapter.max_wait, wait)
+        self._ensure_reaper()
+
+    def _grant(self, adapter: AdapterSlots, instance: Any):
+        lease = Lease(instance, adapter)
+        adapter.leases[instance] = lease
+        self._leases[instance] = lease
+
+    def release(self, instance: Any):
+        """Give the slot back, called when a device disconnected."""
+        lease = self._leases.pop(instance, None)
+        if lease is None:
+            return
+        adapter = lease.adapter
+        del adapter.leases[instance]
+        while adapter.waiters and adapter.free > 0:
+            waiter, future = adapter.waiters.popleft()
+            if future.done():
+                continue
+            self._grant(adapter, waiter)
+            future.set_result(None)
+
+    def _evict_idle(self, adapter: AdapterSlots):
+        """Disconnect the least recently used device which has not been used recently."""
+        if adapter.free > 0 or any(lease.evicting for lease in adapter.leases.values()):
+            return
+        deadline = time.monotonic() - HOT_WINDOW
+        candidates = [lease for lease in adapter.leases.values() if lease.last_used < deadline]
+        if not candidates:
+            return
+        lease = min(candidates, key=lambda lease: lease.last_used)
+        self._disconnect(lease, "to free a connection slot")
+
+    def _disconnect(self, lease: Lease, reason: str):
+        lease.evicting = True
+        LOGGER.debug(f"Disconnecting {lease.instance.mac} {reason}")
+        asyncio.create_task(lease.instance.release_connection())
+
+    def _ensure_reaper(self):
+        if self.idle_timeout and (self._reaper is None or self._reaper.done()):
+            self._reaper = asyncio.create_task(self._reap_idle())
+
+    async def _reap_idle(self):
+        while self._leases:
+            await asyncio.sleep(self.idle_timeout / 2)
+            deadline = time.monotonic() - self.idle_timeout
+            for lease in list(self._leases.values()):
+                if lease.last_used < deadline and not lease.evicting:
+                    self._disconnect(lease, f"after {self.idle_timeout}s idle")
+
+#Shared by all devices
+CONNECTIONS = ConnectionManager()
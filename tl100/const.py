@@ -0,0 +1,68 @@
+import logging
+
+#Shared with the integration, so logging is configured in one place
+LOGGER = logging.getLogger('custom_components.beurer')
+#Advertised name of supported lamps, as matched by the bluetooth integration (see manifest.json)
+LOCAL_NAME = "TL100*"
+
+#Same values as Home Assistant's color modes, this package does not import Home Assistant
+COLOR_MODE_RGB = "rgb"
+COLOR_MODE_WHITE = "white"
+#Mood light effects in the order of their protocol index
+EFFECTS = ("Off", "Random", "Rainbow", "Rainbow Slow", "Fusion", "Pulse", "Wave", "Chill", "Action", "Forest", "Summer")
+
+#Seconds an advertisement stays in the shared cache without being seen again
+ADVERTISEMENT_TTL = 300
+#Seconds to scan when a device is not in the cache
+DISCOVERY_TIMEOUT = 5
+
+#Send commands without waiting for the GATT acknowledgement where the lamp allows it
+PIPELINED_WRITES = True
+#Unacknowledged writes in flight at most, the window shrinks when the link falls behind
+WRITE_WINDOW = 8
+
+#Concurrent connections per bluetooth adapter
+CONNECTION_SLOTS = 5
+#Adapter choice: score is RSSI (dBm) minus these weights times slot usage (0-1), connect seconds and failure rate (0-1)
+SLOT_WEIGHT = 20
+CONNECT_TIME_WEIGHT = 10
+FAILURE_WEIGHT = 30
+#Score a lamp's best adapter needs over its current one before the lamp migrates
+MIGRATE_MARGIN = 10
+#Seconds without commands after which a device is disconnected, 0 keeps connections open
+IDLE_DISCONNECT_TIMEOUT = 0
+#Seconds a device counts as in use after its last command
+HOT_WINDOW = 2
+
+#Seconds before the first reconnect attempt, doubled per failure up to the maximum
+BACKOFF_INITIAL = 2
+BACKOFF_MAX = 300
+
+#Apply commands locally right away and verify them with one status poll after a quiet period
+OPTIMISTIC_UPDATES = True
+#Seconds without commands before the optimistic state is verified
+VERIFY_DELAY = 1.5
+
+#Seconds between status probes of a lamp, growing for lamps which answer and reset for failing ones
+PROBE_INTERVAL = 60
+PROBE_INTERVAL_MIN = 15
+PROBE_INTERVAL_MAX = 600
+#Status requests per second all probes together may send
+PROBE_BUDGET = 2
+
+#Lamps connected at the same time by set_group
+GROUP_CONCURRENCY = 5
+
+#UDP port of the external color stream, see streaming.py
+STREAM_PORT = 21325
+#Interface the stream listens on, the endpoint has no authentication so only local sources are accepted by default
+STREAM_HOST = "127.0.0.1"
+
+#Size of a protocol trace file before it is rotated, records buffered between writes and seconds between writes
+TRACE_MAX_BYTES = 5_000_000
+TRACE_BUFFER = 10000
+TRACE_FLUSH_INTERVAL = 5
+
+#Bounds of the interval between transition frames in seconds
+MIN_FRAME_INTERVAL = 0.03
+MAX_FRAME_INTERVAL = 0.5
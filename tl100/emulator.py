@@ -0,0 +1,248 @@
+"""Software TL100 lamps for development and load tests without hardware.
+
+EmulatedBleakClient implements the parts of the BleakClient API the integration uses
+and talks to EmulatedLamp objects instead of a radio. Lamps decode the frames
+sendPacket produces, keep their state and answer with the notifications
+notification_handler expects. Timing, packet loss, lost connections and shutdown
+notices can be simulated per lamp.
+
+Setting the environment variable BEURER_EMULATOR to a number of lamps makes the
+integration discover and use emulated lamps instead of bluetooth devices.
+"""
+from typing import Callable, Optional
+import asyncio
+import os
+import random
+import types
+
+from bleak import BleakError
+
+from . import beurer, protocol
+from .const import LOGGER
+
+class EmulatedCharacteristic:
+    def __init__(self, uuid: str, properties: list[str]) -> None:
+        self.uuid = uuid
+        self.properties = properties
+        self.description = uuid
+
+class EmulatedLamp:
+    """State and protocol handling of one TL100 lamp.
+
+    Latencies are in seconds, drop_rate is the probability a notification is lost.
+    notify_on_change makes the lamp report state changes without a status request.
+    """
+    def __init__(self, address: str, name: str = "TL100", adapter: str = "emulator") -> None:
+        self.address = address
+        self.name = name
+        self.adapter = adapter
+        #Adapters (or proxies) in range of the lamp and the RSSI they receive it with
+        self.adapters = {adapter: -60}
+        self.write_latency = 0.005
+        self.notify_latency = 0.01
+        self.connect_latency = 0.05
+        #Unacknowledged writes the radio buffers, further ones wait for room
+        self.tx_buffer = 4
+        self.drop_rate = 0.0
+        self.notify_on_change = False
+        self.in_range = True
+        self.rng = random.Random(address)
+        self.white = protocol.Status(protocol.REPLY_WHITE, False, 100)
+        self.mood = protocol.Status(protocol.REPLY_MOOD, False, 100, (255, 255, 255), 0)
+        self.frames = []
+        self.invalid_frames = 0
+        self._client: Optional["EmulatedBleakClient"] = None
+
+    @property
+    def device(self):
+        """BLEDevice stand-in as a scanner would report it."""
+        return self.device_via(self.adapter)
+
+    def device_via(self, adapter: str):
+        """BLEDevice stand-in as the adapter reports it."""
+        return types.SimpleNamespace(address=self.address, name=self.name, details={"source": adapter}, rssi=self.adapters.get(adapter, -100))
+
+    def connect_latency_via(self, adapter: str) -> float:
+        """Weak signals take longer to connect, 10% per dB below -60."""
+        return self.connect_latency * (1 + max(0, -60 - self.adapters.get(adapter, -100)) / 10)
+
+    @property
+    def connected(self) -> bool:
+        return self._client is not None
+
+    def status(self, channel: int) -> protocol.Status:
+        state = self.white if channel == protocol.WHITE else self.mood
+        return state if state.on else protocol.Status(protocol.REPLY_OFF)
+
+    def handle_frame(self, frame: bytes):
+        """Apply a written frame, returns the notifications to send."""
+        self.frames.append(frame)
+        length = len(frame) - 11
+        if (length < 1 or frame[:3] != b"\xfe\xef\x0a" or frame[3] != length + 7 or frame[4:6] != b"\xab\xaa"
+                or frame[6] != length + 2 or frame[-3:] != b"\x55\x0d\x0a"
+                or frame[-4] != protocol.checksum(length + 2, frame[7:7 + length])):
+            self.invalid_frames += 1
+            LOGGER.warning(f"Emulated lamp {self.address} received invalid frame {protocol.hexdump(frame)}")
+            return []
+        message = frame[7:7 + length]
+        opcode = message[0]
+        channel = message[1] if length > 1 else None
+        state = self.white if channel == protocol.WHITE else self.mood
+        if opcode == protocol.STATUS:
+            return [self.status(channel)]
+        if opcode == protocol.ON:
+            state.on = True
+            if channel == protocol.MOOD:
+                #The lamp turns on in rainbow mode when enabling mood light
+                state.effect = 2
+        elif opcode == protocol.OFF:
+            state.on = False
+        elif opcode == protocol.BRIGHTNESS and length > 2:
+            state.brightness = message[2]
+        elif opcode == protocol.COLOR and length > 3:
+            self.mood.rgb = (message[1], message[2], message[3])
+        elif opcode == protocol.EFFECT:
+            self.mood.effect = message[1]
+        else:
+            LOGGER.debug(f"Emulated lamp {self.address} ignores opcode {opcode:#x}")
+            return []
+        if self.notify_on_change:
+            return [self.status(protocol.WHITE), self.status(protocol.MOOD)]
+        return []
+
+    def drop_connection(self):
+        """Simulate a lost connection, e.g. the lamp went out of range."""
+        if self._client:
+            self._client._disconnected()
+
+    async def shutdown(self):
+        """Send the shutdown notice (version 0) and drop the connection like the lamp does."""
+        if self._client:
+            await self._client._deliver(protocol.Status(protocol.REPLY_SHUTDOWN), 0)
+            self.drop_connection()
+
+class Emulator:
+    """Registry of emulated lamps by address."""
+    def __init__(self) -> None:
+        self.lamps: dict[str, EmulatedLamp] = {}
+        self._advertiser = None
+
+    def add_lamp(self, address: Optional[str] = None, name: Optional[str] = None, adapter: str = "emulator") -> EmulatedLamp:
+        index = len(self.lamps)
+        address = address or f"EE:00:00:00:{index // 256:02X}:{index % 256:02X}"
+        lamp = EmulatedLamp(address, name or f"TL100 {index}", adapter)
+        self.lamps[address.lower()] = lamp
+        return lamp
+
+    def lamp(self, address: str) -> Optional[EmulatedLamp]:
+        return self.lamps.get(address.lower())
+
+    def advertise(self, cache):
+        """Feed all lamps in range into an advertisement cache."""
+        for lamp in self.lamps.values():
+            if lamp.in_range:
+                for adapter, rssi in lamp.adapters.items():
+                    cache.update(lamp.device_via(adapter), rssi=rssi)
+
+    def start_advertising(self, cache, interval: float = 30):
+        async def advertise():
+            while True:
+                self.advertise(cache)
+                await asyncio.sleep(interval)
+        cache.add_feed("emulator")
+        if self._advertiser is None or self._advertiser.done():
+            self._advertiser = asyncio.create_task(advertise())
+
+EMULATOR = Emulator()
+
+class EmulatedBleakClient:
+    """BleakClient stand-in connecting to lamps of an Emulator."""
+    emulator = EMULATOR
+
+    def __init__(self, device, disconnected_callback: Optional[Callable] = None, **kwargs) -> None:
+        self.address = getattr(device, "address", device)
+        details = getattr(device, "details", None)
+        self.adapter = details.get("source") if isinstance(details, dict) else None
+        self._disconnected_callback = disconnected_callback
+        self._notify = None
+        self._lamp: Optional[EmulatedLamp] = None
+        self._tx_buffer: Optional[asyncio.Semaphore] = None
+        self.services = types.SimpleNamespace(characteristics={
+            0: EmulatedCharacteristic(beurer.WRITE_CHARACTERISTIC_UUIDS[0], ["write", "write-without-response"]),
+            1: EmulatedCharacteristic(beurer.READ_CHARACTERISTIC_UUIDS[0], ["notify"]),
+        })
+
+    @property
+    def lamp(self) -> Optional[EmulatedLamp]:
+        return self.emulator.lamp(self.address)
+
+    @property
+    def writes(self) -> list:
+        return self.lamp.frames if self.lamp else []
+
+    @property
+    def is_connected(self) -> bool:
+        return self._lamp is not None
+
+    async def connect(self, timeout: float = 20):
+        lamp = self.lamp
+        adapter = self.adapter or (lamp.adapter if lamp else None)
+        if lamp is None or not lamp.in_range or adapter not in lamp.adapters:
+            #A real connect to an absent lamp waits for the timeout, keep the emulated one short
+            await asyncio.sleep(min(timeout, lamp.connect_latency if lamp else 0.05))
+            raise asyncio.TimeoutError(f"Emulated lamp {self.address} not reachable")
+        await asyncio.sleep(lamp.connect_latency_via(adapter))
+        lamp._client = self
+        self._lamp = lamp
+        self._tx_buffer = asyncio.Semaphore(lamp.tx_buffer)
+        return True
+
+    async def disconnect(self):
+        self._disconnected()
+        return True
+
+    def _disconnected(self):
+        if self._lamp is None:
+            return
+        self._lamp._client = None
+        self._lamp = None
+        self._notify = None
+        if self._disconnected_callback:
+            self._disconnected_callback(self)
+
+    async def start_notify(self, uuid, callback):
+        self._notify = callback
+
+    async def stop_notify(self, uuid):
+        self._notify = None
+
+    async def write_gatt_char(self, uuid, data, response: Optional[bool] = None):
+        lamp = self._lamp
+        if lamp is None:
+            raise BleakError(f"Emulated lamp {self.address} not connected")
+        #Writes with response wait for the lamp, without response only for room in the radio buffer
+        if response is False:
+            async with self._tx_buffer:
+                await asyncio.sleep(lamp.write_latency / 4)
+        else:
+            await asyncio.sleep(lamp.write_latency)
+        for status in lamp.handle_frame(bytes(data)):
+            if lamp.rng.random() >= lamp.drop_rate:
+                asyncio.get_running_loop().create_task(self._deliver(status, lamp.notify_latency))
+
+    async def _deliver(self, status: protocol.Status, delay: float):
+        await asyncio.sleep(delay)
+        if self._notify is not None:
+            await self._notify(self.services.characteristics[1], bytearray(protocol.encode_notification(status)))
+
+def install_from_env(cache) -> bool:
+    """Use emulated lamps if BEURER_EMULATOR is set to a number of lamps."""
+    count = int(os.environ.get("BEURER_EMULATOR", "0") or 0)
+    if count <= 0:
+        return False
+    while len(EMULATOR.lamps) < count:
+        EMULATOR.add_lamp()
+    beurer.CLIENT_CLASS = EmulatedBleakClient
+    EMULATOR.start_advertising(cache)
+    LOGGER.warning(f"Using {count} emulated Beurer lamps")
+    return True
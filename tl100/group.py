@@ -0,0 +1,82 @@
+from typing import Optional, Tuple
+import asyncio
+import time
+
+from bleak import BleakError
+
+from .const import LOGGER, GROUP_CONCURRENCY
+
+class GroupResult:
+    """Outcome of a group command for one lamp."""
+    __slots__ = ("mac", "success", "latency", "finished", "packets", "error")
+
+    def __init__(self, mac: str) -> None:
+        self.mac = mac
+        self.success = False
+        self.latency = None
+        self.finished = None
+        self.packets = 0
+        self.error = None
+
+    def as_dict(self) -> dict:
+        return {
+            "success": self.success,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "packets": self.packets,
+            "error": self.error,
+        }
+
+def spread(results: list[GroupResult]) -> Optional[float]:
+    """Seconds between the first and the last lamp finishing."""
+    finished = [result.finished for result in results if result.success]
+    return max(finished) - min(finished) if finished else None
+
+async def set_group(instances: list, concurrency: int = GROUP_CONCURRENCY, on: bool = True,
+                    white_brightness: Optional[int] = None, rgb_color: Optional[Tuple[int, int, int]] = None,
+                    color_brightness: Optional[int] = None, effect: Optional[str] = None) -> list[GroupResult]:
+    """Move many lamps to the same state so they change within a short time window.
+
+    Connecting is the slow part, so all lamps are connected first with at most
+    concurrency connects at a time. The state is then sent to all connected lamps at
+    once, each lamp only gets the packets its own state differs in.
+    """
+    results = [GroupResult(instance.mac) for instance in instances]
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    start_sending = asyncio.Event()
+    ready = 0
+
+    async def drive(instance, result: GroupResult):
+        nonlocal ready
+        try:
+            async with semaphore:
+                connected = await instance.connect()
+            if not connected:
+                result.error = "unavailable"
+                return
+            #Wait for the other lamps to be connected
+            ready += 1
+            if ready == len(instances):
+                start_sending.set()
+            await start_sending.wait()
+            start = time.monotonic()
+            report = await instance.apply_state(on, white_brightness, rgb_color, color_brightness, effect)
+            if report is None:
+                result.error = "cancelled by a newer command"
+                return
+            result.finished = time.monotonic()
+            result.latency = result.finished - start
+            result.packets = report.total_packets
+            result.success = True
+        except (BleakError, asyncio.TimeoutError) as error:
+            result.error = str(error) or type(error).__name__
+        finally:
+            if not result.success and not start_sending.is_set():
+                #Do not keep the others waiting for a lamp that failed
+                ready += 1
+                if ready == len(instances):
+                    start_sending.set()
+
+    await asyncio.gather(*[drive(instance, result) for instance, result in zip(instances, results)])
+    succeeded = sum(result.success for result in results)
+    LOGGER.debug(f"Group command succeeded for {succeeded} of {len(results)} lamps")
+    return results
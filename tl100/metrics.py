@@ -0,0 +1,119 @@
+from typing import Optional
+from contextlib import contextmanager
+import bisect
+import time
+
+#Upper bounds of the histogram buckets, milliseconds for latencies
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000)
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 2) if value is not None else None
+
+class Histogram:
+    """Fixed bucket latency histogram, cheap enough to record every packet."""
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, ms: float):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.min = ms if self.min is None or ms < self.min else self.min
+        self.max = ms if self.max is None or ms > self.max else self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Upper bound of the bucket holding the percentile, the maximum for the last bucket."""
+        if not self.count:
+            return None
+        rank = self.count * percent / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(BUCKETS_MS[index], self.max) if index < len(BUCKETS_MS) else self.max
+        return self.max
+
+    def as_dict(self) -> dict:
+        labels = [f"<={bound}" for bound in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}"]
+        return {
+            "count": self.count,
+            "mean": _round(self.mean),
+            "min": _round(self.min),
+            "max": _round(self.max),
+            "p50": _round(self.percentile(50)),
+            "p95": _round(self.percentile(95)),
+            "buckets": {label: count for label, count in zip(labels, self.counts) if count},
+        }
+
+class DeviceMetrics:
+    """Performance counters of one device."""
+    def __init__(self) -> None:
+        self.write = Histogram()
+        self.reply_rtt = Histogram()
+        self.connect = Histogram()
+        self.service_call = Histogram()
+        self.packets_per_call = Histogram()
+        #Milliseconds logical commands waited for the previous ones of the device
+        self.command_wait = Histogram()
+        self.packets_sent = 0
+        self.packets_unacknowledged = 0
+        self.connects = 0
+        self.connect_failures = 0
+        self.write_failures = 0
+        self.reply_timeouts = 0
+        self.optimistic_mismatches = 0
+        self.entity_writes = 0
+        self.entity_writes_merged = 0
+        self.entity_writes_suppressed = 0
+        self.commands_cancelled = 0
+        self.commands_merged = 0
+        self.command_queue_max = 0
+
+    @property
+    def reconnects(self) -> int:
+        return max(0, self.connects - 1)
+
+    @contextmanager
+    def service_call_timer(self):
+        """Measure a Home Assistant service call and the packets it caused."""
+        start = time.monotonic()
+        packets = self.packets_sent
+        try:
+            yield
+        finally:
+            self.service_call.record((time.monotonic() - start) * 1000)
+            self.packets_per_call.record(self.packets_sent - packets)
+
+    def as_dict(self) -> dict:
+        return {
+            "packets_sent": self.packets_sent,
+            "packets_unacknowledged": self.packets_unacknowledged,
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "connect_failures": self.connect_failures,
+            "write_failures": self.write_failures,
+            "reply_timeouts": self.reply_timeouts,
+            "optimistic_mismatches": self.optimistic_mismatches,
+            "entity_writes": self.entity_writes,
+            "entity_writes_merged": self.entity_writes_merged,
+            "entity_writes_suppressed": self.entity_writes_suppressed,
+            "commands_cancelled": self.commands_cancelled,
+            "commands_merged": self.commands_merged,
+            "command_queue_max": self.command_queue_max,
+            "write_ms": self.write.as_dict(),
+            "reply_rtt_ms": self.reply_rtt.as_dict(),
+            "connect_ms": self.connect.as_dict(),
+            "service_call_ms": self.service_call.as_dict(),
+            "packets_per_call": self.packets_per_call.as_dict(),
+            "command_wait_ms": self.command_wait.as_dict(),
+        }
@@ -0,0 +1,157 @@
+from typing import Any, Optional
+import asyncio
+import heapq
+import itertools
+import random
+import time
+
+from .const import LOGGER, PROBE_INTERVAL, PROBE_INTERVAL_MIN, PROBE_INTERVAL_MAX, PROBE_BUDGET
+
+class ProbeEntry:
+    """Probe timetable of one lamp."""
+    __slots__ = ("instance", "interval", "next_at", "probed_at", "probes", "failures", "skipped")
+
+    def __init__(self, instance: Any, interval: float) -> None:
+        self.instance = instance
+        self.interval = interval
+        #Stagger the first probes over a whole interval
+        self.next_at = time.monotonic() + random.uniform(0, interval)
+        self.probed_at = 0.0
+        self.probes = 0
+        self.failures = 0
+        self.skipped = 0
+
+    def schedule(self):
+        #Jitter keeps lamps registered together from being probed together
+        self.next_at = time.monotonic() + self.interval * random.uniform(0.8, 1.2)
+
+class ProbeScheduler:
+    """Checks the status of all lamps on a staggered timetable within a global budget.
+
+    The budget is a token bucket of BLE operations per second shared by all lamps, a
+    probe costs one operation per status request. Lamps which answer (or recently
+    sent notifications on their own) are probed less often, lamps which failed are
+    probed again soon.
+    """
+    def __init__(self, interval: float = PROBE_INTERVAL, budget: float = PROBE_BUDGET) -> None:
+        self.interval = interval
+        self.budget = budget
+        self._entries: dict[Any, ProbeEntry] = {}
+        self._heap: list = []
+        self._order = itertools.count()
+        self._tokens = budget
+        self._refilled = time.monotonic()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def register(self, instance: Any):
+        if instance in self._entries:
+            return
+        entry = ProbeEntry(instance, self.interval)
+        self._entries[instance] = entry
+        heapq.heappush(self._heap, (entry.next_at, next(self._order), entry))
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def unregister(self, instance: Any):
+        #Heap entries of removed lamps are skipped when they come up
+        self._entries.pop(instance, None)
+        if not self._entries and self._task:
+            self._task.cancel()
+            self._task = None
+
+    def reset(self, instance: Any):
+        """Probe a lamp soon again, e.g. after it dropped the connection unexpectedly."""
+        entry = self._entries.get(instance)
+        if entry is None:
+            return
+        entry.interval = PROBE_INTERVAL_MIN
+        entry.schedule()
+        #The previous heap entry stays behind and is skipped as outdated
+        heapq.heappush(self._heap, (entry.next_at, next(self._order), entry))
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {
+            "budget": self.budget,
+            "lamps": len(self._entries),
+            "probes": sum(entry.probes for entry in self._entries.values()),
+            "failures": sum(entry.failures for entry in self._entries.values()),
+            "skipped": sum(entry.skipped for entry in self._entries.values()),
+        }
+
+    def entry_stats(self, instance: Any) -> Optional[dict]:
+        """Probe timetable of one lamp, None if it is not registered."""
+        entry = self._entries.get(instance)
+        if entry is None:
+            return None
+        return {
+            "budget": self.budget,
+            "interval": round(entry.interval, 1),
+            "next_in": round(max(0.0, entry.next_at - time.monotonic()), 1),
+            "probes": entry.probes,
+            "failures": entry.failures,
+            "skipped": entry.skipped,
+        }
+
+    async def _take(self, cost: float):
+        """Wait until the budget allows cost operations."""
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.budget, self._tokens + (now - self._refilled) * self.budget)
+            self._refilled = now
+            if self._tokens >= min(cost, self.budget):
+                self._tokens -= cost
+                return
+            await asyncio.sleep((min(cost, self.budget) - self._tokens) / self.budget)
+
+    async def _run(self):
+        while self._entries:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            due, _, entry = self._heap[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            if self._entries.get(entry.instance) is not entry or due != entry.next_at:
+                #Removed lamp or rescheduled since
+                continue
+            asyncio.create_task(self._probe(entry))
+
+    async def _probe(self, entry: ProbeEntry):
+        instance = entry.instance
+        if instance.last_notification > entry.probed_at and time.monotonic() - instance.last_notification < entry.interval:
+            #The lamp reported its state since the last probe, e.g. after a command
+            entry.skipped += 1
+            answered = True
+        else:
+            #Two status requests, or a connect which sends them
+            await self._take(2)
+            entry.probes += 1
+            try:
+                answered = await instance.probe()
+            except Exception as error:
+                LOGGER.debug(f"Probing {instance.mac} failed: {error}")
+                answered = False
+        entry.probed_at = time.monotonic()
+        if answered:
+            entry.interval = min(PROBE_INTERVAL_MAX, entry.interval * 1.5)
+        else:
+            entry.failures += 1
+            entry.interval = PROBE_INTERVAL_MIN
+        if self._entries.get(instance) is entry:
+            entry.schedule()
+            heapq.heappush(self._heap, (entry.next_at, next(self._order), entry))
+            self._wakeup.set()
+
+#Shared by all lamps
+PROBES = ProbeScheduler()
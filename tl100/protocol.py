@@ -0,0 +1,95 @@
+"""TL100 BLE protocol: frame encoding and notification parsing.
+
+Frames look like FE EF 0A <len+7> AB AA <len+2> <message> <checksum> 55 0D 0A where
+the checksum is <len+2> XOR all message bytes. This module has no Home Assistant or
+bleak imports so it can be used and benchmarked on its own.
+"""
+from typing import Optional, Sequence
+
+#Opcodes
+STATUS = 0x30
+BRIGHTNESS = 0x31
+COLOR = 0x32
+EFFECT = 0x34
+OFF = 0x35
+ON = 0x37
+
+#Channels
+WHITE = 0x01
+MOOD = 0x02
+
+#Reply versions of notifications
+REPLY_SHUTDOWN = 0
+REPLY_WHITE = 1
+REPLY_MOOD = 2
+REPLY_OFF = 255
+
+def checksum(b: int, message: Sequence[int]) -> int:
+    for byte in message:
+        b ^= byte
+    return b
+
+def _encode(message: Sequence[int]) -> bytes:
+    length = len(message)
+    #A single bytes() call, measured faster in CPython than filling a preallocated buffer
+    return bytes((0xFE, 0xEF, 0x0A, length + 7, 0xAB, 0xAA, length + 2, *message, checksum(length + 2, message), 0x55, 0x0D, 0x0A))
+
+#Two byte messages without a variable value (status requests, on/off) are built only once
+_CONSTANT_FRAMES = {(opcode << 8) | channel: _encode((opcode, channel)) for opcode in (STATUS, OFF, ON) for channel in (WHITE, MOOD)}
+
+def encode(message: Sequence[int]) -> bytes:
+    """Return the complete frame for a message."""
+    if len(message) == 2:
+        frame = _CONSTANT_FRAMES.get((message[0] << 8) | message[1])
+        if frame is not None:
+            return frame
+    return _encode(message)
+
+def status_request(channel: int) -> bytes:
+    return encode((STATUS, channel))
+
+def power(channel: int, on: bool) -> bytes:
+    return encode((ON if on else OFF, channel))
+
+class Status:
+    """A parsed status notification.
+
+    brightness is the 0-100 value of the lamp, rgb and effect (index into the effect
+    list) are only set for mood light (version 2) replies.
+    """
+    __slots__ = ("version", "on", "brightness", "rgb", "effect")
+
+    def __init__(self, version: int, on: bool = False, brightness: int = 0,
+                 rgb: Optional[tuple] = None, effect: Optional[int] = None) -> None:
+        self.version = version
+        self.on = on
+        self.brightness = brightness
+        self.rgb = rgb
+        self.effect = effect
+
+    def __repr__(self) -> str:
+        return f"Status(version={self.version}, on={self.on}, brightness={self.brightness}, rgb={self.rgb}, effect={self.effect})"
+
+def parse_notification(data: bytes) -> Optional[Status]:
+    """Parse a notification, None if it is too short for its reply version."""
+    if len(data) < 9:
+        return None
+    version = data[8]
+    if version == REPLY_WHITE:
+        return Status(version, data[9] == 1, data[10]) if len(data) > 10 else None
+    if version == REPLY_MOOD:
+        return Status(version, data[9] == 1, data[10], (data[13], data[14], data[15]), data[16]) if len(data) > 16 else None
+    return Status(version)
+
+def encode_notification(status: Status) -> bytes:
+    """Build the notification a lamp sends for a status, the inverse of parse_notification."""
+    if status.version == REPLY_WHITE:
+        return _encode((STATUS, REPLY_WHITE, int(status.on), status.brightness))
+    if status.version == REPLY_MOOD:
+        r, g, b = status.rgb or (0, 0, 0)
+        return _encode((STATUS, REPLY_MOOD, int(status.on), status.brightness, 0, 0, r, g, b, status.effect or 0))
+    return _encode((STATUS, status.version))
+
+def hexdump(data: Sequence[int]) -> str:
+    """Hex representation for debug logs, only build it when debug logging is enabled."""
+    return bytes(data).hex(" ")
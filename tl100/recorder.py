@@ -0,0 +1,213 @@
+"""Binary trace of the frames exchanged with lamps and offline replay of such traces.
+
+A trace file starts with MAGIC, followed by records of a RECORD header (monotonic
+timestamp, direction, 6 byte device id, payload length) and the raw frame. Records
+are collected in a ring buffer and appended to the file in the background, the file
+is rotated to <path>.1 once it exceeds its size limit.
+
+Setting the environment variable BEURER_TRACE to a file path records all lamps,
+benchmarks/replay_trace.py replays a trace against emulated lamps.
+"""
+from typing import Iterator, Optional
+from collections import deque
+import asyncio
+import hashlib
+import os
+import struct
+import threading
+import time
+
+from bleak import BleakError
+
+from .const import LOGGER, TRACE_MAX_BYTES, TRACE_BUFFER, TRACE_FLUSH_INTERVAL
+from .metrics import Histogram
+from . import protocol
+
+MAGIC = b"BTRC\x01"
+RECORD = struct.Struct("<dB6sH")
+
+OUTBOUND = 0
+INBOUND = 1
+
+def device_id(mac: str) -> bytes:
+    """6 byte id of a device, the MAC itself or a hash of other addresses (e.g. macOS UUIDs)."""
+    digits = mac.replace(":", "").replace("-", "")
+    if len(digits) == 12:
+        try:
+            return bytes.fromhex(digits)
+        except ValueError:
+            pass
+    return hashlib.blake2b(mac.encode(), digest_size=6).digest()
+
+def format_device(device: bytes) -> str:
+    return ":".join(f"{byte:02X}" for byte in device)
+
+class TraceRecorder:
+    """Ring buffer of trace records appended to a rotating file.
+
+    record only packs the header and appends to the buffer, so it can stay enabled in
+    production. When the file writer falls behind the oldest records are dropped.
+    """
+    def __init__(self, path: str, max_bytes: int = TRACE_MAX_BYTES, buffer_size: int = TRACE_BUFFER,
+                 flush_interval: float = TRACE_FLUSH_INTERVAL) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self.recorded = 0
+        self.written = 0
+        self.rotations = 0
+        self._task = None
+        #A cancelled background flush keeps running in its executor thread
+        self._flush_lock = threading.Lock()
+
+    @property
+    def dropped(self) -> int:
+        return self.recorded - self.written - len(self._buffer)
+
+    def record(self, device: bytes, direction: int, data: bytes):
+        self._buffer.append(RECORD.pack(time.monotonic(), direction, device, len(data)) + bytes(data))
+        self.recorded += 1
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._buffer:
+                try:
+                    await loop.run_in_executor(None, self.flush)
+                except OSError as error:
+                    LOGGER.warning(f"Could not write trace {self.path}: {error}")
+
+    def flush(self):
+        """Append the buffered records to the file, blocking, run it in an executor.
+
+        Flushes are serialized, concurrent ones would interleave records and rotations.
+        """
+        with self._flush_lock:
+            records = []
+            while self._buffer:
+                records.append(self._buffer.popleft())
+            if not records:
+                return
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            if size and size + sum(map(len, records)) > self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+                self.rotations += 1
+                size = 0
+            with open(self.path, "ab") as file:
+                if not size:
+                    file.write(MAGIC)
+                file.write(b"".join(records))
+            self.written += len(records)
+
+    def stats(self) -> dict:
+        return {"path": self.path, "recorded": self.recorded, "written": self.written,
+                "dropped": self.dropped, "rotations": self.rotations}
+
+def install_from_env() -> Optional[TraceRecorder]:
+    """Record all lamps if BEURER_TRACE is set to a file path."""
+    from . import beurer
+
+    path = os.environ.get("BEURER_TRACE")
+    if not path:
+        return None
+    if beurer.RECORDER is None or beurer.RECORDER.path != path:
+        beurer.RECORDER = TraceRecorder(path)
+        LOGGER.warning(f"Recording a trace of all Beurer lamps to {path}")
+    beurer.RECORDER.start()
+    return beurer.RECORDER
+
+async def async_stop_installed():
+    """Write the remaining records of the recorder installed from the environment."""
+    from . import beurer
+
+    if beurer.RECORDER is not None:
+        await beurer.RECORDER.stop()
+
+class TraceRecord:
+    __slots__ = ("time", "direction", "device", "data")
+
+    def __init__(self, time: float, direction: int, device: bytes, data: bytes) -> None:
+        self.time = time
+        self.direction = direction
+        self.device = device
+        self.data = data
+
+    def __repr__(self) -> str:
+        arrow = "->" if self.direction == OUTBOUND else "<-"
+        return f"{self.time:.6f} {format_device(self.device)} {arrow} {protocol.hexdump(self.data)}"
+
+def read_trace(path: str) -> Iterator[TraceRecord]:
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a Beurer trace")
+        while True:
+            header = file.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            timestamp, direction, device, length = RECORD.unpack(header)
+            yield TraceRecord(timestamp, direction, device, file.read(length))
+
+class ReplayStats:
+    """Timing of a replay, lag is how late a record was handled compared to the trace."""
+    def __init__(self) -> None:
+        self.frames = 0
+        self.notifications = 0
+        self.errors = 0
+        self.lag = Histogram()
+        self.write = Histogram()
+        self.notification = Histogram()
+
+    def as_dict(self) -> dict:
+        return {
+            "frames": self.frames,
+            "notifications": self.notifications,
+            "errors": self.errors,
+            "lag_ms": self.lag.as_dict(),
+            "write_ms": self.write.as_dict(),
+            "notification_ms": self.notification.as_dict(),
+        }
+
+async def replay(records: list[TraceRecord], instance, speed: float = 1.0) -> ReplayStats:
+    """Feed recorded frames through the command path and notifications through notification_handler.
+
+    Records keep their recorded spacing divided by speed, speed 0 replays as fast as possible.
+    """
+    stats = ReplayStats()
+    if not records:
+        return stats
+    start = time.monotonic()
+    origin = records[0].time
+    for record in records:
+        due = (record.time - origin) / speed if speed > 0 else 0
+        delay = due - (time.monotonic() - start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        stats.lag.record(max(0.0, -delay) * 1000)
+        handled = time.monotonic()
+        if record.direction == OUTBOUND:
+            message = list(record.data[7:-4])
+            try:
+                await instance.sendPacket(message)
+            except BleakError as error:
+                stats.errors += 1
+                LOGGER.debug(f"Replaying {record} failed: {error}")
+                continue
+            stats.frames += 1
+            stats.write.record((time.monotonic() - handled) * 1000)
+        else:
+            await instance.notification_handler(None, bytearray(record.data))
+            stats.notifications += 1
+            stats.notification.record((time.monotonic() - handled) * 1000)
+    return stats
@@ -0,0 +1,229 @@
+from typing import AsyncIterator, Callable, Optional
+from contextlib import aclosing
+import asyncio
+import fnmatch
+import time
+
+from bleak import BleakScanner, BLEDevice, BleakError
+
+from .const import LOGGER, ADVERTISEMENT_TTL, DISCOVERY_TIMEOUT, LOCAL_NAME
+from .connection import adapter_of
+
+class Advertisement:
+    """Latest advertisement seen for a device."""
+    __slots__ = ("device", "advertisement", "rssi", "last_seen")
+
+    def __init__(self, device: BLEDevice, advertisement, rssi: Optional[int]) -> None:
+        self.device = device
+        self.advertisement = advertisement
+        self.rssi = rssi
+        self.last_seen = time.monotonic()
+
+class AdvertisementCache:
+    """Index of MAC -> latest BLEDevice/advertisement/RSSI fed by one long-lived scanner.
+
+    Lookups are answered from the index, a scan is only waited for on a cache miss.
+    When Home Assistant's bluetooth integration is available its callbacks feed the
+    index instead of an own scanner. It only calls back when an advertisement changes,
+    so device lookups then ask it directly instead of relying on the TTL.
+    """
+    def __init__(self, ttl: float = ADVERTISEMENT_TTL) -> None:
+        self.ttl = ttl
+        self._entries: dict[str, Advertisement] = {}
+        #Latest advertisement per adapter (or proxy) which received it
+        self._sources: dict[str, dict[str, Advertisement]] = {}
+        self._waiters: dict[str, list[asyncio.Future]] = {}
+        self._listeners: list[Callable[[BLEDevice], None]] = []
+        self._scanner = None
+        self._unsubscribe = None
+        self._hass = None
+        self._bluetooth = None
+        self._feeds: set[str] = set()
+        self._start_lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._scanner is not None or self._unsubscribe is not None or bool(self._feeds)
+
+    @property
+    def hass_attached(self) -> bool:
+        """True while Home Assistant's bluetooth integration feeds the index."""
+        return self._hass is not None
+
+    def add_feed(self, name: str):
+        """Advertisements arrive from elsewhere (e.g. the emulator), no own scanner is needed."""
+        self._feeds.add(name)
+
+    def _evict(self):
+        if self._hass is not None:
+            #Presence is checked with Home Assistant on lookup, unchanged advertisements are not repeated
+            return
+        deadline = time.monotonic() - self.ttl
+        for mac in [mac for mac, entry in self._entries.items() if entry.last_seen < deadline]:
+            del self._entries[mac]
+            self._sources.pop(mac, None)
+
+    def update(self, device: BLEDevice, advertisement=None, rssi: Optional[int] = None):
+        """Record an advertisement, called by the scanner or the bluetooth integration."""
+        mac = device.address.lower()
+        if rssi is None and advertisement is not None:
+            rssi = getattr(advertisement, "rssi", None)
+        entry = Advertisement(device, advertisement, rssi)
+        self._entries[mac] = entry
+        self._sources.setdefault(mac, {})[adapter_of(device)] = entry
+        for future in self._waiters.pop(mac, []):
+            if not future.done():
+                future.set_result(device)
+        for listener in self._listeners:
+            listener(device)
+
+    def _detection_callback(self, device: BLEDevice, advertisement):
+        self.update(device, advertisement)
+
+    def _bluetooth_callback(self, service_info, change):
+        self.update(service_info.device, service_info.advertisement, service_info.rssi)
+
+    async def async_attach_hass(self, hass, local_name: str = LOCAL_NAME) -> Callable:
+        """Feed the index from Home Assistant's bluetooth integration instead of an own scanner.
+
+        An own scanner started before (e.g. by a config flow) is stopped. Only devices with
+        an advertised name matching local_name are reported.
+        """
+        from homeassistant.components import bluetooth
+
+        await self.async_stop()
+        if self._unsubscribe is None:
+            for service_info in bluetooth.async_discovered_service_info(hass, connectable=True):
+                if fnmatch.fnmatchcase(service_info.name or "", local_name):
+                    self._bluetooth_callback(service_info, None)
+            self._unsubscribe = bluetooth.async_register_callback(
+                hass, self._bluetooth_callback, {"local_name": local_name, "connectable": True},
+                bluetooth.BluetoothScanningMode.PASSIVE)
+            self._hass = hass
+            self._bluetooth = bluetooth
+            LOGGER.debug("Using Home Assistant bluetooth callbacks for advertisements")
+
+        def detach():
+            if self._unsubscribe:
+                self._unsubscribe()
+                self._unsubscribe = None
+                self._hass = None
+                self._bluetooth = None
+        return detach
+
+    async def async_start(self):
+        """Start the long-lived scanner unless advertisements already arrive from somewhere."""
+        async with self._start_lock:
+            if self.running:
+                return
+            try:
+                scanner = BleakScanner(detection_callback=self._detection_callback, scanning_mode="passive")
+                await scanner.start()
+            except (BleakError, ValueError) as error:
+                #Passive scanning needs backend specific arguments, fall back to active scanning
+                LOGGER.debug(f"Passive scanning not available, using active scanning: {error}")
+                scanner = BleakScanner(detection_callback=self._detection_callback)
+                await scanner.start()
+            self._scanner = scanner
+            LOGGER.debug("Started advertisement scanner")
+
+    async def async_stop(self):
+        if self._scanner is not None:
+            scanner, self._scanner = self._scanner, None
+            await scanner.stop()
+            LOGGER.debug("Stopped advertisement scanner")
+
+    def get(self, mac: str) -> Optional[Advertisement]:
+        self._evict()
+        entry = self._entries.get(mac.lower())
+        if self._hass is None:
+            return entry
+        device = self._bluetooth.async_ble_device_from_address(self._hass, mac.upper(), connectable=True)
+        if device is None:
+            return None
+        if entry is None or entry.device is not device:
+            #Home Assistant knows a newer device (e.g. seen by another adapter) than the last callback
+            entry = Advertisement(device, entry.advertisement if entry else None, entry.rssi if entry else None)
+            self._entries[mac.lower()] = entry
+        return entry
+
+    def sources(self, mac: str) -> dict[str, Advertisement]:
+        """Recent advertisements of a device by the adapter which received them."""
+        deadline = time.monotonic() - self.ttl
+        sources = self._sources.get(mac.lower(), {})
+        for adapter in [adapter for adapter, entry in sources.items() if entry.last_seen < deadline]:
+            del sources[adapter]
+        return dict(sources)
+
+    def devices(self) -> list[BLEDevice]:
+        self._evict()
+        if self._hass is not None:
+            return [entry.device for entry in map(self.get, list(self._entries)) if entry is not None]
+        return [entry.device for entry in self._entries.values()]
+
+    async def async_get_device(self, mac: str, timeout: float = DISCOVERY_TIMEOUT) -> Optional[BLEDevice]:
+        """Return the device from the index, waiting for its advertisement on a cache miss."""
+        entry = self.get(mac)
+        if entry:
+            return entry.device
+        await self.async_start()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(mac.lower(), []).append(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiters = self._waiters.get(mac.lower(), [])
+            if future in waiters:
+                waiters.remove(future)
+
+    async def async_stream(self, match: Callable[[BLEDevice], bool] = lambda device: True,
+                           timeout: float = DISCOVERY_TIMEOUT) -> AsyncIterator[BLEDevice]:
+        """Yield matching devices as they are seen, the known ones first, until the timeout."""
+        queue: asyncio.Queue = asyncio.Queue()
+        seen = set()
+        listener = lambda device: queue.put_nowait(device) if match(device) else None
+        self._listeners.append(listener)
+        try:
+            for device in self.devices():
+                if match(device):
+                    seen.add(device.address.lower())
+                    yield device
+            await self.async_start()
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            while True:
+                try:
+                    device = await asyncio.wait_for(queue.get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    return
+                if device.address.lower() not in seen:
+                    seen.add(device.address.lower())
+                    yield device
+        finally:
+            self._listeners.remove(listener)
+
+    async def async_discover(self, match: Callable[[BLEDevice], bool] = lambda device: True,
+                             timeout: float = DISCOVERY_TIMEOUT, count: Optional[int] = 1,
+                             mac: Optional[str] = None) -> list[BLEDevice]:
+        """Return matching devices as soon as count of them or the device with the MAC were seen.
+
+        Without count and MAC all devices seen until the timeout are returned.
+        """
+        devices = []
+        async with aclosing(self.async_stream(match, timeout)) as stream:
+            async for device in stream:
+                devices.append(device)
+                if mac is not None:
+                    if device.address.lower() == mac.lower():
+                        break
+                elif count is not None and len(devices) >= count:
+                    break
+        #Devices known from the cache but not yielded yet are returned as well
+        known = {device.address.lower() for device in devices}
+        devices.extend(device for device in self.devices() if match(device) and device.address.lower() not in known)
+        return devices
+
+#Shared by all config entries and the config flow
+ADVERTISEMENTS = AdvertisementCache()
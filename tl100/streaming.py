@@ -0,0 +1,147 @@
+"""Streaming of RGB frames from external sources (screen capture, music) to lamps.
+
+A UDP endpoint receives datagrams made of 4 byte records <lamp index> <r> <g> <b>,
+the index refers to the list of lamps the stream was started for. Anyone who can reach
+the endpoint can drive the lamps, it listens on loopback unless another host is given. Every lamp only
+keeps the newest frame and sends it as soon as the link takes it, so a slow link
+drops frames instead of building a backlog. Status polling is paused while streaming.
+"""
+from typing import Optional, Tuple
+import asyncio
+import time
+
+from bleak import BleakError
+
+from .const import LOGGER, STREAM_HOST, STREAM_PORT
+from .metrics import Histogram
+
+class StreamStats:
+    """Frames of one lamp, dropped frames were replaced by a newer one before being sent."""
+    __slots__ = ("frames_received", "frames_sent", "frames_dropped", "started", "latency")
+
+    def __init__(self) -> None:
+        self.frames_received = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.started = time.monotonic()
+        #Milliseconds from receiving a frame to handing it to the lamp
+        self.latency = Histogram()
+
+    @property
+    def fps(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.frames_sent / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "frames_received": self.frames_received,
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "fps": round(self.fps, 1),
+            "latency_ms": self.latency.as_dict(),
+        }
+
+class LampStream:
+    """Newest-frame-wins sender for one lamp."""
+    def __init__(self, instance) -> None:
+        self.instance = instance
+        self.stats = StreamStats()
+        self._frame: Optional[Tuple[int, int, int]] = None
+        self._received_at = 0.0
+        self._pending = asyncio.Event()
+        self._task = None
+
+    def push(self, rgb: Tuple[int, int, int], received_at: float):
+        self.stats.frames_received += 1
+        if self._frame is not None:
+            self.stats.frames_dropped += 1
+        self._frame = rgb
+        self._received_at = received_at
+        self._pending.set()
+
+    def start(self):
+        self.stats = StreamStats()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self._pending.wait()
+            self._pending.clear()
+            frame, received_at = self._frame, self._received_at
+            self._frame = None
+            if frame is None:
+                continue
+            try:
+                await self.instance.stream_color(frame)
+            except BleakError as error:
+                LOGGER.debug(f"Streaming to {self.instance.mac} failed: {error}")
+                continue
+            self.stats.frames_sent += 1
+            self.stats.latency.record((time.monotonic() - received_at) * 1000)
+
+class _StreamProtocol(asyncio.DatagramProtocol):
+    def __init__(self, stream: "ColorStream") -> None:
+        self._stream = stream
+
+    def datagram_received(self, data: bytes, addr):
+        self._stream.feed(data)
+
+class ColorStream:
+    """UDP endpoint forwarding RGB frames to lamps."""
+    def __init__(self, instances: list, host: str = STREAM_HOST, port: int = STREAM_PORT) -> None:
+        self.host = host
+        self.port = port
+        self.lamps = [LampStream(instance) for instance in instances]
+        self.invalid_datagrams = 0
+        self._transport = None
+
+    @property
+    def active(self) -> bool:
+        return self._transport is not None
+
+    async def start(self, listen: bool = True):
+        """Open the endpoint and prepare the lamps, listen=False only accepts frames from feed."""
+        #Bind first, a port in use or a bad host must not leave the lamps in streaming mode
+        if listen:
+            self._transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: _StreamProtocol(self), local_addr=(self.host, self.port))
+        await asyncio.gather(*[lamp.instance.start_streaming() for lamp in self.lamps], return_exceptions=True)
+        for lamp in self.lamps:
+            lamp.start()
+        LOGGER.info(f"Streaming to {len(self.lamps)} lamps on udp {self.host}:{self.port}")
+
+    def feed(self, data: bytes, received_at: Optional[float] = None):
+        """Hand a datagram of <index> <r> <g> <b> records to the lamps."""
+        if not data or len(data) % 4:
+            self.invalid_datagrams += 1
+            return
+        received_at = received_at if received_at is not None else time.monotonic()
+        for offset in range(0, len(data), 4):
+            index = data[offset]
+            if index < len(self.lamps):
+                self.lamps[index].push((data[offset + 1], data[offset + 2], data[offset + 3]), received_at)
+
+    async def stop(self) -> dict:
+        """Close the endpoint, resume normal operation of the lamps and return the statistics."""
+        if self._transport:
+            self._transport.close()
+            self._transport = None
+        for lamp in self.lamps:
+            await lamp.stop()
+        await asyncio.gather(*[lamp.instance.stop_streaming() for lamp in self.lamps], return_exceptions=True)
+        return self.stats()
+
+    def stats(self) -> dict:
+        return {
+            "invalid_datagrams": self.invalid_datagrams,
+            "lamps": {lamp.instance.mac: lamp.stats.as_dict() for lamp in self.lamps},
+        }
@@ -0,0 +1,131 @@
+from typing import Optional, Tuple
+import asyncio
+import time
+
+from bleak import BleakError
+
+from .const import COLOR_MODE_RGB, COLOR_MODE_WHITE, LOGGER, MIN_FRAME_INTERVAL, MAX_FRAME_INTERVAL
+
+#Lowest brightness a fade starts from or ends at, in Home Assistant scale
+MIN_BRIGHTNESS = 3
+
+class TransitionStats:
+    """Frames of one transition, dropped frames were skipped because the link fell behind."""
+    __slots__ = ("frames_sent", "frames_dropped", "duration", "interval")
+
+    def __init__(self) -> None:
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.duration = 0.0
+        self.interval = None
+
+    @property
+    def fps(self) -> float:
+        return self.frames_sent / self.duration if self.duration else 0.0
+
+    def as_dict(self) -> dict:
+        return {"frames_sent": self.frames_sent, "frames_dropped": self.frames_dropped,
+                "fps": round(self.fps, 1), "interval_ms": round(self.interval * 1000, 1) if self.interval else None}
+
+def _mix(start: float, end: float, progress: float) -> int:
+    return round(start + (end - start) * progress)
+
+async def run_transition(instance, duration: float, white: bool = False, rgb_color: Optional[Tuple[int, int, int]] = None,
+                         brightness: Optional[int] = None, off: bool = False) -> TransitionStats:
+    """Fade a channel of the lamp by streaming interpolated color/brightness frames.
+
+    The frame interval follows the time the lamp needs per frame. When a frame is still
+    being sent at the next tick that tick is dropped, so the lamp never lags behind.
+    """
+    stats = TransitionStats()
+    channel = 0x01 if white else 0x02
+    channel_on = instance._light_on if white else instance._color_on
+    current = (instance._brightness if white else instance._color_brightness) or 255
+    rgb_from = tuple(instance._rgb_color or (255, 255, 255))
+    rgb_to = tuple(rgb_color) if rgb_color is not None else rgb_from
+    if off:
+        if not channel_on:
+            return stats
+        brightness_from, brightness_to = current, MIN_BRIGHTNESS
+    else:
+        brightness_from = current if channel_on else MIN_BRIGHTNESS
+        brightness_to = brightness if brightness is not None else current
+        if not channel_on:
+            #Turn on dark with the target color, then fade the brightness up
+            if white:
+                await instance.apply_state(white_brightness=MIN_BRIGHTNESS)
+            else:
+                await instance.apply_state(rgb_color=rgb_to, color_brightness=MIN_BRIGHTNESS)
+            rgb_from = rgb_to
+
+    #Start at the rate the link managed so far
+    frame_time = instance.metrics.write.mean / 1000 if instance.metrics.write.count else MIN_FRAME_INTERVAL
+    interval = min(MAX_FRAME_INTERVAL, max(MIN_FRAME_INTERVAL, frame_time))
+    sent = {}
+    in_flight = None
+
+    async def send(messages: list):
+        nonlocal frame_time, interval
+        frame_start = time.monotonic()
+        for message in messages:
+            await instance.sendPacket(message)
+            sent[message[0]] = message
+        #Adapt the interval to what the link sustains
+        frame_time = 0.7 * frame_time + 0.3 * (time.monotonic() - frame_start)
+        interval = min(MAX_FRAME_INTERVAL, max(MIN_FRAME_INTERVAL, frame_time * 1.2))
+        stats.frames_sent += 1
+
+    def frame(progress: float) -> list:
+        messages = []
+        if not white:
+            color = [0x32, *(_mix(start, end, progress) for start, end in zip(rgb_from, rgb_to))]
+            if sent.get(0x32) != color:
+                messages.append(color)
+        level = [0x31, channel, max(1, int(_mix(brightness_from, brightness_to, progress) / 255 * 100))]
+        if sent.get(0x31) != level:
+            messages.append(level)
+        return messages
+
+    start = time.monotonic()
+    try:
+        while True:
+            progress = min(1.0, (time.monotonic() - start) / duration) if duration > 0 else 1.0
+            messages = frame(progress)
+            if in_flight is not None and not in_flight.done():
+                stats.frames_dropped += 1
+            elif messages:
+                in_flight = asyncio.create_task(send(messages))
+            if progress >= 1.0:
+                break
+            await asyncio.sleep(interval)
+        #The last frame must arrive even if the link was behind
+        if in_flight is not None:
+            await in_flight
+        final = frame(1.0)
+        if final:
+            await send(final)
+    except asyncio.CancelledError:
+        if in_flight is not None:
+            in_flight.cancel()
+        LOGGER.debug(f"Transition of {instance.mac} cancelled after {stats.frames_sent} frames")
+        raise
+    except BleakError as error:
+        LOGGER.warning(f"Transition of {instance.mac} aborted: {error}")
+        return stats
+    stats.duration = time.monotonic() - start
+    stats.interval = interval
+    LOGGER.debug(f"Transition of {instance.mac}: {stats.as_dict()}")
+
+    if off:
+        await instance.turn_off()
+        #Turning on again restores the brightness from before the fade
+        if not white:
+            instance._color_brightness = current
+    elif white:
+        instance._mode = COLOR_MODE_WHITE
+        await instance._command_done(_light_on=True, _brightness=brightness_to)
+    else:
+        instance._mode = COLOR_MODE_RGB
+        instance._rgb_color = rgb_to
+        await instance._command_done(_color_on=True, _color_brightness=brightness_to)
+    return stats